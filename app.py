@@ -3,7 +3,13 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import datetime
-from db_manager import DBManager
+import io
+import os
+from db_manager import APPOINTMENTS_PAGE_SIZE, VISITS_PAGE_SIZE, get_db_manager
+import data_export
+import log_archive
+import patient_import
+import query_monitor
 
 # --- Configuration de la page ---
 st.set_page_config(
@@ -996,8 +1002,8 @@ st.markdown("""
 
 
 # --- Initialisation ---
-if 'db' not in st.session_state:
-    st.session_state.db = DBManager()
+# Un seul DBManager (et donc un seul pool MongoDB) par processus, partagé par toutes les sessions
+st.session_state.db = get_db_manager()
 
 if 'user' not in st.session_state:
     st.session_state.user = None
@@ -1036,9 +1042,19 @@ def login_form():
 def logout():
     """Deconnecte l'utilisateur."""
     st.session_state.db.log_action(st.session_state.user["username"], "LOGOUT", "Deconnexion utilisateur")
+    discard_export()
     st.session_state.user = None
     st.rerun()
 
+def discard_export():
+    """Supprime le fichier d'export temporaire de la session, s'il existe."""
+    export_file = st.session_state.pop("export_file", None)
+    if export_file:
+        try:
+            os.remove(export_file[1])
+        except OSError:
+            pass
+
 def sidebar_user_card(user):
     """Displays styled user info in sidebar."""
     initials = user["username"][:2].upper()
@@ -1244,17 +1260,32 @@ def view_accueil():
         search_query = st.text_input("Rechercher un patient (Nom, Prenom)", "", placeholder="Tapez un nom ou prenom...")
 
         if search_query:
-            results = st.session_state.db.search_patients(search_query)
+            results = st.session_state.db.search_patient_summaries(search_query)
             if results:
                 st.success(f"{len(results)} patient(s) trouve(s)")
-                for pat in results:
-                    with st.expander(f"📂 {pat['nom']} {pat['prenom']}"):
-                        if st.button("📅 Prendre RDV pour ce patient", key=f"btn_nav_rdv_{pat['_id']}"):
-                            st.session_state.rdv_patient_results = [pat]
+                # Un seul dossier complet charge a la fois : celui de la fiche ouverte
+                open_id = st.session_state.get("patient_card_id")
+                for pat_summary in results:
+                    is_open = pat_summary["_id"] == open_id
+                    with st.expander(f"📂 {pat_summary['nom']} {pat_summary['prenom']}", expanded=is_open):
+                        if st.button("📅 Prendre RDV pour ce patient", key=f"btn_nav_rdv_{pat_summary['_id']}"):
+                            st.session_state.rdv_patient_results = [pat_summary]
                             st.session_state.rdv_search_performed = True
                             st.session_state.current_accueil_tab = "➕ Nouveau Rendez-vous"
                             st.rerun()
 
+                        if not is_open:
+                            st.caption(f"Tel: {pat_summary.get('telephone', 'N/A')}")
+                            if st.button("Ouvrir le dossier", key=f"open_patient_{pat_summary['_id']}"):
+                                st.session_state.patient_card_id = pat_summary["_id"]
+                                st.rerun()
+                            continue
+
+                        pat = st.session_state.db.get_patient(pat_summary["_id"])
+                        if pat is None:
+                            st.warning("Ce dossier n'existe plus.")
+                            continue
+
                         ci1, ci2, ci3 = st.columns(3)
                         ci1.markdown(f"**Tel:** {pat.get('telephone', 'N/A')}")
                         ci2.markdown(f"**Email:** {pat.get('email', 'N/A')}")
@@ -1262,12 +1293,25 @@ def view_accueil():
 
                         st.markdown("**Notes Medicales:**")
                         st.info(pat.get('notes_medicales', 'Aucune note'))
-                        st.markdown("**Historique Visites:**")
-                        hist = pat.get('historique_visites', [])
-                        if hist:
-                            st.table(pd.DataFrame(hist))
-                        else:
-                            st.caption("Aucune visite enregistree")
+                        # Historique lu a la demande, par pages (collection visits)
+                        if st.toggle("Historique Visites", key=f"show_visits_{pat['_id']}"):
+                            visits_page = st.session_state.get(f"visits_page_{pat['_id']}", 0)
+                            hist, has_more = st.session_state.db.get_patient_visits(
+                                pat['_id'], skip=visits_page * VISITS_PAGE_SIZE
+                            )
+                            if hist:
+                                st.table(pd.DataFrame(hist))
+                            else:
+                                st.caption("Aucune visite enregistree")
+                            if visits_page > 0 or has_more:
+                                v1, v2, v3 = st.columns([1, 2, 1])
+                                if v1.button("◀ Plus recentes", key=f"visits_prev_{pat['_id']}", disabled=visits_page == 0):
+                                    st.session_state[f"visits_page_{pat['_id']}"] = visits_page - 1
+                                    st.rerun()
+                                v2.caption(f"Page {visits_page + 1}")
+                                if v3.button("Plus anciennes ▶", key=f"visits_next_{pat['_id']}", disabled=not has_more):
+                                    st.session_state[f"visits_page_{pat['_id']}"] = visits_page + 1
+                                    st.rerun()
 
                         with st.expander("Modifier les informations"):
                             with st.form(key=f"edit_patient_{pat['_id']}"):
@@ -1340,11 +1384,23 @@ def view_accueil():
             if st.button("Rechercher", key="btn_search_trigger"):
                 st.session_state.rdv_search_performed = True
                 if search_query:
-                    st.session_state.rdv_patient_results = st.session_state.db.search_patients(search_query)
+                    st.session_state.rdv_patient_results = st.session_state.db.search_patient_summaries(search_query)
                 else:
                     st.session_state.rdv_patient_results = []
                     st.warning("Veuillez saisir une recherche.")
 
+        # Suggestions instantanees servies par l'index memoire (aucune requete par saisie)
+        if search_query:
+            suggestions = st.session_state.db.autocomplete_patients(search_query)
+            if suggestions:
+                st.caption("Suggestions :")
+                sugg_cols = st.columns(2)
+                for i, (sugg_id, sugg_label) in enumerate(suggestions):
+                    if sugg_cols[i % 2].button(sugg_label, key=f"sugg_{sugg_id}", use_container_width=True):
+                        st.session_state.rdv_patient_results = st.session_state.db.search_patient_summaries(str(sugg_id))
+                        st.session_state.rdv_search_performed = True
+                        st.rerun()
+
         if st.session_state.rdv_patient_results:
             pat_options = {f"{p['nom']} {p['prenom']} (Tel: {p.get('telephone', 'N/A')})": p['_id'] for p in st.session_state.rdv_patient_results}
 
@@ -1360,25 +1416,99 @@ def view_accueil():
         st.markdown("##### 2. Details du Rendez-vous")
 
         practitioners = st.session_state.db.get_practitioners()
-        practitioner_names = [p["nom"] for p in practitioners]
+        # Les listes de praticiens portent les identifiants ; seul le nom est affiche
+        practitioner_names = {p["_id"]: p["nom"] for p in practitioners}
+        practitioner_ids = list(practitioner_names)
+
+        # Valeurs du formulaire gardees en session : un creneau suggere les pre-remplit
+        if st.session_state.get("rdv_practitioner") not in practitioner_names:
+            st.session_state.rdv_practitioner = practitioner_ids[0] if practitioner_ids else None
+        if "rdv_date" not in st.session_state:
+            st.session_state.rdv_date = datetime.date.today()
+        if "rdv_time" not in st.session_state:
+            st.session_state.rdv_time = datetime.time(9, 0)
+        if "rdv_duree" not in st.session_state:
+            st.session_state.rdv_duree = 30
+        if "rdv_free_slots" not in st.session_state:
+            st.session_state.rdv_free_slots = None
+
+        with st.expander("🔎 Trouver un creneau libre"):
+            specialties = sorted({p["specialite"] for p in practitioners if p.get("specialite")})
+            col_sp, col_ss = st.columns(2)
+            slot_practitioner = col_sp.selectbox("Praticien", ["Tous"] + practitioner_ids, key="slot_practitioner",
+                                                 format_func=lambda v: practitioner_names.get(v, v))
+            slot_specialty = col_ss.selectbox("Specialite", ["Toutes"] + specialties, key="slot_specialty")
+            col_sf, col_sn, col_sd = st.columns(3)
+            slot_from = col_sf.date_input("A partir du", datetime.date.today(), key="slot_from")
+            slot_days = col_sn.number_input("Nombre de jours", min_value=1, max_value=31, value=7, key="slot_days")
+            slot_duree = col_sd.number_input("Duree (minutes)", min_value=15, max_value=120, value=30, step=15, key="slot_duree")
+
+            if st.button("Chercher les creneaux", key="btn_free_slots"):
+                st.session_state.rdv_free_slots = st.session_state.db.find_free_slots(
+                    slot_from, slot_from + datetime.timedelta(days=int(slot_days) - 1), int(slot_duree),
+                    practitioners=None if slot_practitioner == "Tous" else [slot_practitioner],
+                    specialty=None if slot_specialty == "Toutes" else slot_specialty,
+                    limit=30
+                )
+
+            if st.session_state.rdv_free_slots:
+                st.caption("Cliquez sur un creneau pour pre-remplir le formulaire :")
+                slot_cols = st.columns(3)
+                for i, slot in enumerate(st.session_state.rdv_free_slots):
+                    label = f"{slot['start'].strftime('%d/%m %H:%M')} - {slot['practitioner']}"
+                    if slot_cols[i % 3].button(label, key=f"slot_{slot['practitioner_id']}_{slot['start'].strftime('%Y%m%d%H%M')}", use_container_width=True):
+                        st.session_state.rdv_practitioner = slot["practitioner_id"]
+                        st.session_state.rdv_date = slot["start"].date()
+                        st.session_state.rdv_time = slot["start"].time()
+                        st.session_state.rdv_duree = int((slot["end"] - slot["start"]).total_seconds() // 60)
+                        st.session_state.rdv_free_slots = None
+                        st.rerun()
+            elif st.session_state.rdv_free_slots is not None:
+                st.info("Aucun creneau libre sur cette periode.")
+
+        # Hors du formulaire : afficher ou masquer les options de repetition sans le soumettre
+        recurrent = st.toggle("🔁 Rendez-vous recurrent (suivi hebdomadaire)", key="rdv_recurrent")
+        if recurrent:
+            end_mode = st.radio("Fin de la serie", ["Nombre de seances", "Date de fin"], horizontal=True, key="rdv_end_mode")
 
         with st.form("new_appt_form"):
-            practitioner = st.selectbox("Praticien", practitioner_names)
+            practitioner = st.selectbox("Praticien", practitioner_ids, key="rdv_practitioner",
+                                        format_func=lambda v: practitioner_names.get(v, ""))
             col_d, col_t = st.columns(2)
-            date_rdv = col_d.date_input("Date", datetime.date.today())
-            time_rdv = col_t.time_input("Heure de debut", datetime.time(9, 0))
-            duree = st.number_input("Duree (minutes)", min_value=15, max_value=120, value=30, step=15)
+            date_rdv = col_d.date_input("Date", key="rdv_date")
+            time_rdv = col_t.time_input("Heure de debut", key="rdv_time")
+            duree = st.number_input("Duree (minutes)", min_value=15, max_value=120, step=15, key="rdv_duree")
             motif = st.text_input("Motif de la consultation")
 
+            if recurrent:
+                col_i, col_v = st.columns(2)
+                interval_weeks = col_i.number_input("Toutes les (semaines)", min_value=1, max_value=8, value=1, key="rdv_interval")
+                if end_mode == "Nombre de seances":
+                    series_count = col_v.number_input("Seances", min_value=2, max_value=52, value=10, key="rdv_count")
+                    series_until = None
+                else:
+                    series_until = col_v.date_input("Jusqu'au (inclus)", date_rdv + datetime.timedelta(weeks=12),
+                                                    min_value=date_rdv, key="rdv_until")
+                    series_count = None
+
             submit_rdv = st.form_submit_button("Confirmer le Rendez-vous", use_container_width=True)
 
             if submit_rdv:
                 if selected_patient_id:
                     start_datetime = datetime.datetime.combine(date_rdv, time_rdv)
 
-                    success, msg = st.session_state.db.create_appointment(
-                        selected_patient_id, practitioner, start_datetime, duree, motif, st.session_state.user["username"]
-                    )
+                    if recurrent:
+                        success, msg, conflicts = st.session_state.db.create_appointment_series(
+                            selected_patient_id, practitioner, start_datetime, duree, motif, st.session_state.user["username"],
+                            interval_weeks=int(interval_weeks), until=series_until,
+                            count=int(series_count) if series_count else None
+                        )
+                        if conflicts:
+                            st.warning("Creneaux deja pris (non reserves) : " + ", ".join(c.strftime("%d/%m/%Y %H:%M") for c in conflicts))
+                    else:
+                        success, msg = st.session_state.db.create_appointment(
+                            selected_patient_id, practitioner, start_datetime, duree, motif, st.session_state.user["username"]
+                        )
                     if success:
                         st.success(msg)
                     else:
@@ -1388,78 +1518,105 @@ def view_accueil():
 
     # --- Onglet Liste Globale ---
     elif st.session_state.current_accueil_tab == "📋 Liste Globale":
-        all_appts = st.session_state.db.get_appointments()
         practitioners = st.session_state.db.get_practitioners()
 
-        if all_appts:
-            df_all = pd.DataFrame(all_appts)
-
-            for prac in practitioners:
-                prac_name = prac["nom"]
-                with st.expander(f"🩺 {prac_name} — {prac.get('specialite', 'Generaliste')}", expanded=True):
-                    df_prac = df_all[df_all["practitioner_name"] == prac_name]
-
-                    if not df_prac.empty:
-                        df_prac = df_prac.sort_values(by="date_heure_debut")
-
-                        h1, h2, h3, h4, h5 = st.columns([2, 3, 3, 2, 3])
-                        h1.markdown("**Horaire**")
-                        h2.markdown("**Patient**")
-                        h3.markdown("**Motif**")
-                        h4.markdown("**Statut**")
-                        h5.markdown("**Actions**")
-                        st.divider()
-
-                        for idx, row in df_prac.iterrows():
-                            c1, c2, c3, c4, c5 = st.columns([2, 3, 3, 2, 3])
-
-                            start_str = row["date_heure_debut"].strftime("%d/%m %H:%M")
-                            c1.write(f"{start_str}")
-                            c2.write(f"{row['patient_nom']}")
-                            c3.write(f"{row['motif']}")
-                            c4.markdown(status_badge(row['statut']), unsafe_allow_html=True)
-
-                            if "Annulé" not in row['statut']:
-                                with c5:
-                                    now = datetime.datetime.now()
-                                    time_diff = row["date_heure_debut"] - now
-                                    is_too_close = time_diff.total_seconds() < 1800
-
-                                    if is_too_close:
-                                        st.caption("Modification bloquee (<30min)")
-
-                                    with st.popover("🕒 Retard"):
-                                        delay_min = st.number_input("Minutes de retard", min_value=1, max_value=120, value=15, step=5, key=f"val_delay_{row['_id']}")
-                                        if st.button("Appliquer", key=f"btn_apply_{row['_id']}"):
-                                            new_start = row["date_heure_debut"] + datetime.timedelta(minutes=delay_min)
-                                            success, msg = st.session_state.db.reschedule_appointment(
-                                                row['_id'], new_start, row['duree_minutes'], st.session_state.user["username"]
-                                            )
-                                            if success:
-                                                st.toast(f"Retard de {delay_min} min applique.")
-                                                st.rerun()
-                                            else:
-                                                st.error(msg)
-
-                                    if st.button("Absence Med.", key=f"doc_abs_{row['_id']}"):
-                                        st.session_state.db.update_appointment_status(row['_id'], "Annulé (Medecin Absent)", st.session_state.user["username"])
-                                        st.toast("RDV annule pour absence medecin.")
+        # Fenetre de dates bornant la requete cote serveur
+        w1, w2 = st.columns(2)
+        window_start = w1.date_input("A partir du", datetime.date.today(), key="liste_start")
+        window_days = w2.number_input("Nombre de jours", min_value=1, max_value=90, value=7, key="liste_days")
+        start_dt = datetime.datetime.combine(window_start, datetime.time.min)
+        end_dt = start_dt + datetime.timedelta(days=int(window_days))
+
+        # Pages par praticien, remises a zero quand la fenetre change
+        if st.session_state.get("liste_window") != (start_dt, end_dt):
+            st.session_state.liste_window = (start_dt, end_dt)
+            st.session_state.liste_pages = {}
+
+        counts = st.session_state.db.count_appointments_by_practitioner(start_dt, end_dt)
+        if not counts:
+            st.info("Aucun rendez-vous sur cette periode.")
+
+        page_size = APPOINTMENTS_PAGE_SIZE
+        for prac in practitioners:
+            prac_id, prac_name = prac["_id"], prac["nom"]
+            total = counts.get(prac_id, 0)
+            if not total:
+                continue
+
+            # Le contenu n'est charge que si l'interrupteur est active
+            opened = st.toggle(f"🩺 {prac_name} — {prac.get('specialite', 'Generaliste')} ({total} RDV)", key=f"liste_open_{prac_id}")
+            if not opened:
+                continue
+
+            n_pages = (total + page_size - 1) // page_size
+            page = min(st.session_state.liste_pages.get(prac_id, 0), n_pages - 1)
+            appts = st.session_state.db.get_practitioner_appointments(prac_id, start_dt, end_dt, skip=page * page_size, limit=page_size)
+
+            with st.container(border=True):
+                h1, h2, h3, h4, h5 = st.columns([2, 3, 3, 2, 3])
+                h1.markdown("**Horaire**")
+                h2.markdown("**Patient**")
+                h3.markdown("**Motif**")
+                h4.markdown("**Statut**")
+                h5.markdown("**Actions**")
+                st.divider()
+
+                for row in appts:
+                    c1, c2, c3, c4, c5 = st.columns([2, 3, 3, 2, 3])
+
+                    start_str = row["date_heure_debut"].strftime("%d/%m %H:%M")
+                    c1.write(f"{start_str}")
+                    c2.write(f"{row['patient_nom']}")
+                    c3.write(f"{row['motif']}")
+                    c4.markdown(status_badge(row['statut']), unsafe_allow_html=True)
+
+                    if row["is_active"]:
+                        with c5:
+                            now = datetime.datetime.now()
+                            time_diff = row["date_heure_debut"] - now
+                            is_too_close = time_diff.total_seconds() < 1800
+
+                            if is_too_close:
+                                st.caption("Modification bloquee (<30min)")
+
+                            with st.popover("🕒 Retard"):
+                                delay_min = st.number_input("Minutes de retard", min_value=1, max_value=120, value=15, step=5, key=f"val_delay_{row['_id']}")
+                                if st.button("Appliquer", key=f"btn_apply_{row['_id']}"):
+                                    new_start = row["date_heure_debut"] + datetime.timedelta(minutes=delay_min)
+                                    success, msg = st.session_state.db.reschedule_appointment(
+                                        row['_id'], new_start, row['duree_minutes'], st.session_state.user["username"]
+                                    )
+                                    if success:
+                                        st.toast(f"Retard de {delay_min} min applique.")
                                         st.rerun()
-                            else:
-                                c5.caption("Cloture")
+                                    else:
+                                        st.error(msg)
 
-                            st.divider()
+                            if st.button("Absence Med.", key=f"doc_abs_{row['_id']}"):
+                                st.session_state.db.update_appointment_status(row['_id'], "Annulé (Medecin Absent)", st.session_state.user["username"])
+                                st.toast("RDV annule pour absence medecin.")
+                                st.rerun()
                     else:
-                        st.info(f"Aucun rendez-vous pour {prac_name}.")
-        else:
-            st.info("Aucun rendez-vous dans le systeme.")
+                        c5.caption("Cloture")
+
+                    st.divider()
+
+                if n_pages > 1:
+                    p1, p2, p3 = st.columns([1, 2, 1])
+                    if p1.button("◀ Precedent", key=f"liste_prev_{prac_id}", disabled=page == 0):
+                        st.session_state.liste_pages[prac_id] = page - 1
+                        st.rerun()
+                    p2.caption(f"Page {page + 1} / {n_pages}")
+                    if p3.button("Suivant ▶", key=f"liste_next_{prac_id}", disabled=page >= n_pages - 1):
+                        st.session_state.liste_pages[prac_id] = page + 1
+                        st.rerun()
 
 def view_responsable():
     page_header("Statistiques & Analyses", "Indicateurs de performance du cabinet")
 
     stats = st.session_state.db.get_dashboard_stats()
     cancel_rate = stats['cancellation_rate']
-    workload_data = st.session_state.db.get_stats_workload()
+    workload_data = stats['workload']
 
     # KPI Row
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
@@ -1543,10 +1700,63 @@ def view_responsable():
         st.info("Pas assez de donnees pour la croissance.")
     st.markdown('</div>', unsafe_allow_html=True)
 
+    # Export des donnees (ecrit en flux, par lots, sans DataFrame intermediaire)
+    st.markdown('<div class="med-card"><div class="med-card-header">Export des Donnees</div>', unsafe_allow_html=True)
+    datasets = {"Rendez-vous": "appointments", "Patients": "patients"}
+    if st.session_state.user["role"] == "Administrateur":
+        datasets["Logs"] = "logs"
+    e1, e2, e3 = st.columns(3)
+    export_label = e1.selectbox("Donnees", list(datasets.keys()), key="export_dataset")
+    export_format = e2.selectbox("Format", ["csv", "parquet"], key="export_format")
+    export_dates = e3.date_input("Periode", value=(), key="export_dates")
+    dataset = datasets[export_label]
+
+    export_practitioner = None
+    if dataset == "appointments":
+        prac_names = {p["_id"]: p["nom"] for p in st.session_state.db.get_practitioners()}
+        choice = st.selectbox("Praticien", ["Tous"] + list(prac_names), key="export_practitioner",
+                              format_func=lambda v: prac_names.get(v, v))
+        export_practitioner = None if choice == "Tous" else choice
+
+    if st.button("Preparer l'export", key="btn_export"):
+        date_from = datetime.datetime.combine(export_dates[0], datetime.time.min) if len(export_dates) > 0 else None
+        date_to = datetime.datetime.combine(export_dates[-1] + datetime.timedelta(days=1), datetime.time.min) if len(export_dates) > 1 else None
+        if dataset == "logs":
+            st.session_state.db.audit.flush()
+        discard_export()
+        # Ecrit sur disque : seul le chemin reste en session, pas le contenu du fichier
+        path = data_export.spool_file(export_format)
+        try:
+            with st.spinner("Export en cours..."):
+                rows = data_export.export(st.session_state.db.db, dataset, export_format, path,
+                                          date_from, date_to, export_practitioner)
+            st.session_state.export_file = (data_export.export_filename(dataset, export_format), path, rows)
+        except RuntimeError as e:
+            os.remove(path)
+            st.error(str(e))
+
+    if st.session_state.get("export_file") and not os.path.exists(st.session_state.export_file[1]):
+        # Fichier expiré (EXPORT_SPOOL_TTL_MINUTES) et supprimé par un autre export
+        st.session_state.pop("export_file")
+    if st.session_state.get("export_file"):
+        file_name, path, rows = st.session_state.export_file
+
+        def read_export():
+            # Lu seulement au clic sur le bouton, pas a chaque rerun
+            with open(path, "rb") as f:
+                return f.read()
+
+        st.download_button(f"Telecharger {file_name} ({rows} lignes)", read_export, file_name=file_name,
+                           mime="text/csv" if file_name.endswith(".csv") else "application/octet-stream",
+                           on_click="ignore")
+    st.markdown('</div>', unsafe_allow_html=True)
+
 def view_admin():
     page_header("Administration", "Gestion des utilisateurs, praticiens et logs")
 
-    tab_users, tab_practitioners, tab_logs = st.tabs(["Utilisateurs", "Praticiens", "Logs Systeme"])
+    tab_users, tab_practitioners, tab_logs, tab_import, tab_perf = st.tabs(
+        ["Utilisateurs", "Praticiens", "Logs Systeme", "Import Patients", "Performance"]
+    )
 
     with tab_users:
         st.markdown('<div class="med-card"><div class="med-card-header">Utilisateurs existants</div>', unsafe_allow_html=True)
@@ -1650,9 +1860,34 @@ def view_admin():
 
     with tab_logs:
         st.markdown('<div class="med-card"><div class="med-card-header">Journal d\'audit</div>', unsafe_allow_html=True)
-        logs = st.session_state.db.get_logs()
+
+        # Filtres appliques cote serveur
+        log_users, log_actions = st.session_state.db.get_log_filter_values()
+        f1, f2, f3 = st.columns(3)
+        f_user = f1.selectbox("Utilisateur", ["Tous"] + log_users, key="logs_f_user")
+        f_action = f2.selectbox("Action", ["Toutes"] + log_actions, key="logs_f_action")
+        f_dates = f3.date_input("Periode", value=(), key="logs_f_dates")
+
+        date_from = datetime.datetime.combine(f_dates[0], datetime.time.min) if len(f_dates) > 0 else None
+        date_to = datetime.datetime.combine(f_dates[-1], datetime.time.max) if len(f_dates) > 1 else None
+        filters = (f_user, f_action, date_from, date_to)
+        if date_from and date_from < log_archive.hot_cutoff():
+            st.caption(f"Periode anterieure aux {log_archive.LOG_RETENTION_DAYS} derniers jours : les logs archives sont inclus.")
+
+        # Pile des curseurs de pagination : la page i commence apres logs_cursors[i]
+        if st.session_state.get("logs_filters") != filters:
+            st.session_state.logs_filters = filters
+            st.session_state.logs_cursors = [None]
+
+        logs, next_cursor = st.session_state.db.get_logs_page(
+            after=st.session_state.logs_cursors[-1],
+            user=None if f_user == "Tous" else f_user,
+            action=None if f_action == "Toutes" else f_action,
+            date_from=date_from,
+            date_to=date_to
+        )
         if logs:
-            rows_html = ""
+            rows = []
             for i, log in enumerate(logs):
                 ts = log.get("timestamp", "")
                 if hasattr(ts, "strftime"):
@@ -1668,12 +1903,13 @@ def view_admin():
                 elif "LOGIN" in action:
                     badge_color = "#457B9D"
                 row_bg = "#F8FAFC" if i % 2 == 0 else "#FFFFFF"
-                rows_html += f"""<tr style="background:{row_bg};border-bottom:1px solid #E2E8F0;">
+                rows.append(f"""<tr style="background:{row_bg};border-bottom:1px solid #E2E8F0;">
                     <td style="color:#1B2A4A !important;padding:10px 14px;font-size:0.88em;">{ts}</td>
                     <td style="color:#1B2A4A !important;padding:10px 14px;font-size:0.88em;font-weight:500;">{log.get('user','')}</td>
                     <td style="padding:10px 14px;"><span style="background:{badge_color};color:#fff;padding:3px 12px;border-radius:12px;font-size:0.8em;font-weight:600;">{action}</span></td>
                     <td style="color:#1B2A4A !important;padding:10px 14px;font-size:0.88em;">{log.get('details','')}</td>
-                </tr>"""
+                </tr>""")
+            rows_html = "".join(rows)
             st.markdown(f"""
             <table style="width:100%;border-collapse:collapse;background:#FFFFFF;border-radius:10px;overflow:hidden;box-shadow:0 1px 4px rgba(0,0,0,0.06);">
                 <thead>
@@ -1691,12 +1927,101 @@ def view_admin():
             """, unsafe_allow_html=True)
         else:
             st.info("Aucun log disponible.")
+
+        page_index = len(st.session_state.logs_cursors) - 1
+        n1, n2, n3 = st.columns([1, 2, 1])
+        if n1.button("← Precedent", disabled=page_index == 0, key="logs_prev"):
+            st.session_state.logs_cursors.pop()
+            st.rerun()
+        n2.caption(f"Page {page_index + 1}")
+        if n3.button("Suivant →", disabled=next_cursor is None, key="logs_next"):
+            st.session_state.logs_cursors.append(next_cursor)
+            st.rerun()
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    with tab_import:
+        st.markdown('<div class="med-card"><div class="med-card-header">Import de patients (CSV / JSONL)</div>', unsafe_allow_html=True)
+        st.caption("Colonnes : nom, prenom, telephone, email, assurance, notes_medicales. Nom et prenom obligatoires.")
+        upload = st.file_uploader("Fichier patients", type=["csv", "jsonl", "ndjson"], key="import_file")
+
+        if upload is not None and st.button("Importer", key="btn_import_patients"):
+            try:
+                fmt = patient_import.detect_format(upload.name)
+                stream = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+                with st.spinner("Import en cours..."):
+                    summary, rejects = patient_import.import_patients(
+                        st.session_state.db, patient_import.iter_rows(stream, fmt), st.session_state.user["username"]
+                    )
+                st.session_state.import_result = (summary, patient_import.rejects_report_csv(rejects) if rejects else None)
+            except (ValueError, UnicodeDecodeError) as e:
+                st.error(f"Fichier illisible : {e}")
+
+        if st.session_state.get("import_result"):
+            summary, rejects_csv = st.session_state.import_result
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Lignes lues", summary["read"])
+            m2.metric("Patients importes", summary["imported"])
+            m3.metric("Rejets", summary["rejected"])
+            if rejects_csv:
+                st.download_button("Telecharger le rapport de rejets", rejects_csv, file_name="rejets_import.csv", mime="text/csv")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+    with tab_perf:
+        monitor = query_monitor.query_monitor
+        st.markdown('<div class="med-card"><div class="med-card-header">Requetes MongoDB par operation</div>', unsafe_allow_html=True)
+        if query_monitor.QUERY_MONITORING == "off":
+            st.info("Mesure desactivee (QUERY_MONITORING=off).")
+        st.caption(
+            f"Fenetre glissante de {monitor.window_minutes} min, seuil de requete lente : {monitor.slow_ms:g} ms. "
+            "Percentiles arrondis a la borne de leur classe d'histogramme."
+        )
+        sort_labels = {"Temps cumule": "total_ms", "p95": "p95_ms", "Max": "max_ms", "Nombre": "count"}
+        p1, p2 = st.columns([3, 1])
+        sort_by = p1.radio("Trier par", list(sort_labels), horizontal=True, key="perf_sort")
+        if p2.button("Reinitialiser", key="btn_perf_reset"):
+            monitor.reset()
+            st.rerun()
+
+        offenders = monitor.top_offenders(limit=20, sort=sort_labels[sort_by])
+        if offenders:
+            df_perf = pd.DataFrame(offenders).rename(columns={
+                "operation": "Operation", "collection": "Collection", "command": "Commande",
+                "count": "Appels", "errors": "Erreurs", "total_ms": "Total (ms)", "mean_ms": "Moyenne (ms)",
+                "p50_ms": "p50 (ms)", "p95_ms": "p95 (ms)", "p99_ms": "p99 (ms)", "max_ms": "Max (ms)",
+                "mean_docs": "Docs / appel"
+            })
+            st.dataframe(df_perf, use_container_width=True, hide_index=True)
+
+            operations = sorted({o["operation"] for o in offenders})
+            hist_op = st.selectbox("Histogramme des durees", ["Toutes"] + operations, key="perf_hist_op")
+            hist = monitor.histogram(None if hist_op == "Toutes" else hist_op)
+            fig = px.bar(x=[label for label, _ in hist], y=[count for _, count in hist],
+                         labels={"x": "Duree", "y": "Commandes"}, color_discrete_sequence=["#0077B6"])
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("Aucune requete mesuree sur la periode.")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+        st.markdown('<div class="med-card"><div class="med-card-header">Requetes lentes</div>', unsafe_allow_html=True)
+        slow = monitor.slow_queries()
+        if slow:
+            df_slow = pd.DataFrame(slow)
+            df_slow["timestamp"] = df_slow["timestamp"].dt.strftime("%d/%m/%Y %H:%M:%S")
+            st.dataframe(df_slow.rename(columns={
+                "timestamp": "Date/Heure", "operation": "Operation", "collection": "Collection",
+                "command": "Commande", "filter": "Champs filtres", "duration_ms": "Duree (ms)",
+                "docs": "Docs", "failed": "Echec"
+            }), use_container_width=True, hide_index=True)
+        else:
+            st.info("Aucune requete lente.")
         st.markdown('</div>', unsafe_allow_html=True)
 
 # --- Point d'entree Principal ---
 
 def main():
     if st.session_state.db.db is None:
+        # Ne pas garder en cache un gestionnaire sans connexion : nouvelle tentative au prochain rerun
+        get_db_manager.clear()
         st.error("Impossible de se connecter a la base de donnees. Verifiez que MongoDB est lance.")
         return
 
@@ -0,0 +1,21 @@
+"""Modèle de statut normalisé des rendez-vous.
+
+Le libellé `statut` reste celui affiché ; `statut_code` est un code stable et
+`is_active` indique si le RDV occupe son créneau (faux pour toutes les annulations).
+Les requêtes filtrent sur `is_active`, ce qui permet des bornes d'index exactes là
+où `{"statut": {"$not": {"$regex": "^Annulé"}}}` imposait un parcours.
+"""
+
+STATUS_CODES = {
+    "Confirmé": "CONFIRMED",
+    "Absent": "NO_SHOW",
+    "Annulé": "CANCELLED",
+    "Annulé (Medecin Absent)": "CANCELLED_PRACTITIONER",
+}
+
+
+def status_fields(statut):
+    """Champs de statut à écrire dans un RDV pour le libellé `statut`."""
+    is_active = not statut.startswith("Annulé")
+    code = STATUS_CODES.get(statut, "OTHER" if is_active else "CANCELLED")
+    return {"statut": statut, "statut_code": code, "is_active": is_active}
@@ -0,0 +1,184 @@
+"""Écriture différée (write-behind) du journal d'audit.
+
+Les entrées sont placées dans une file mémoire bornée et insérées par lots
+(`insert_many`) par un thread de fond, dès que le lot est plein ou que le délai
+de vidage est écoulé. Les actions déclarées « durables » sont écrites de façon
+synchrone avant de rendre la main, comme toutes les entrées si la file est pleine.
+
+Un lot dont l'insertion échoue est réessayé avec un délai croissant, puis écrit
+entrée par entrée ; les entrées encore refusées sont remises en file plutôt que
+perdues.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# "async" (par défaut) ou "sync" pour retrouver l'écriture directe
+AUDIT_LOG_MODE = os.getenv("AUDIT_LOG_MODE", "async")
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv("AUDIT_LOG_QUEUE_SIZE", "10000"))
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "200"))
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "1.0"))
+# Nouvelles tentatives d'un lot refusé (délai doublé à chaque fois) avant l'écriture unitaire
+AUDIT_LOG_RETRIES = int(os.getenv("AUDIT_LOG_RETRIES", "3"))
+AUDIT_LOG_RETRY_DELAY = float(os.getenv("AUDIT_LOG_RETRY_DELAY", "0.5"))
+# Attente max. (s) de `flush` pour les lots en cours d'écriture par le thread de fond
+AUDIT_LOG_FLUSH_TIMEOUT = float(os.getenv("AUDIT_LOG_FLUSH_TIMEOUT", "10"))
+# Actions écrites immédiatement (liste séparée par des virgules)
+AUDIT_LOG_DURABLE_ACTIONS = frozenset(
+    a.strip() for a in os.getenv(
+        "AUDIT_LOG_DURABLE_ACTIONS", "CREATE_USER,DELETE_APPT,DELETE_PRACTITIONER"
+    ).split(",") if a.strip()
+)
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class AuditLogSink:
+    """File d'attente des entrées de log vidée par lots dans une collection MongoDB."""
+
+    def __init__(self, collection, mode=AUDIT_LOG_MODE, queue_size=AUDIT_LOG_QUEUE_SIZE,
+                 batch_size=AUDIT_LOG_BATCH_SIZE, flush_interval=AUDIT_LOG_FLUSH_INTERVAL,
+                 durable_actions=AUDIT_LOG_DURABLE_ACTIONS, retries=AUDIT_LOG_RETRIES,
+                 retry_delay=AUDIT_LOG_RETRY_DELAY):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durable_actions = durable_actions
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        if mode == "async":
+            self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def write(self, entry, durable=False):
+        """Enregistre une entrée ; synchrone si `durable`, si l'action l'exige ou en mode sync."""
+        if durable or self._thread is None or entry.get("action") in self.durable_actions:
+            self.collection.insert_one(entry)
+            return
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            # File saturée : on écrit directement plutôt que de perdre l'entrée
+            self.collection.insert_one(entry)
+
+    def flush(self, timeout=AUDIT_LOG_FLUSH_TIMEOUT):
+        """Écrit toutes les entrées en attente, y compris le lot en cours d'écriture par le thread de fond.
+
+        Retourne faux si des entrées restent non écrites après `timeout` secondes.
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._insert(batch)
+        # Chaque entrée retirée de la file est marquée `task_done` une fois écrite (ou
+        # remise en file) : on attend aussi le lot déjà retiré par le thread de fond
+        done = self._queue.all_tasks_done
+        deadline = time.monotonic() + timeout
+        with done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("Journal d'audit : %d entrée(s) encore en attente après flush",
+                                   self._queue.unfinished_tasks)
+                    return False
+                done.wait(remaining)
+        return True
+
+    def close(self):
+        """Arrête le thread de fond et vide la file (appelé à l'arrêt du processus)."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=max(self.flush_interval * 2, 1))
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._insert(batch)
+
+    def _insert(self, batch):
+        """Écrit un lot retiré de la file, puis marque ses entrées comme traitées."""
+        if not batch:
+            return
+        try:
+            failed = self._insert_with_retry(batch)
+            if failed:
+                failed = self._insert_one_by_one(failed)
+            if failed:
+                self._requeue(failed)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _insert_with_retry(self, batch):
+        """`insert_many` réessayé avec un délai croissant ; retourne les entrées non écrites."""
+        pending = batch
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                self.collection.insert_many(pending, ordered=False)
+                return []
+            except BulkWriteError as e:
+                # Doublons d'_id : entrées déjà écrites lors d'une tentative précédente
+                rejected = {err["index"] for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY}
+                pending = [entry for i, entry in enumerate(pending) if i in rejected]
+                if not pending:
+                    return []
+            except Exception:
+                pass
+            logger.warning("Échec d'écriture de %d entrée(s) du journal d'audit (tentative %d/%d)",
+                           len(pending), attempt + 1, self.retries + 1)
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+        return pending
+
+    def _insert_one_by_one(self, entries):
+        """Écriture synchrone entrée par entrée (actions durables en premier) ; retourne les refus."""
+        failed = []
+        for entry in sorted(entries, key=lambda e: e.get("action") not in self.durable_actions):
+            try:
+                self.collection.insert_one(entry)
+            except DuplicateKeyError:
+                pass
+            except Exception:
+                failed.append(entry)
+        return failed
+
+    def _requeue(self, entries):
+        """Remet en file les entrées refusées ; elles ne sont perdues que si la file est pleine ou arrêtée."""
+        lost = 0
+        for entry in entries:
+            if self._thread is None:
+                lost += 1
+                continue
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                lost += 1
+        if lost:
+            logger.error("Journal d'audit : %d entrée(s) perdue(s) après échec d'écriture", lost)
@@ -0,0 +1,163 @@
+"""Index mémoire pour la saisie semi-automatique des patients.
+
+Structure compacte partagée par toutes les sessions du processus :
+* `_keys` : liste triée des clés normalisées (mots du nom/prénom, numéro de téléphone
+  réduit à ses chiffres) ; une recherche par préfixe est une dichotomie (`bisect`) ;
+* `_refs` : tableau d'entiers parallèle à `_keys`, indice du patient dans `_patients` ;
+* `_patients` : un objet `_Patient` (`__slots__`) par patient.
+
+Une mise à jour de patient ajoute ses nouvelles clés et « éteint » l'ancienne fiche
+(pierre tombale) ; les tombes disparaissent au rechargement périodique, qui rattrape
+aussi les écritures faites par d'autres processus. Pendant un rechargement, les
+recherches continuent sur l'ancien index ; les mises à jour reçues entre-temps sont
+rejouées sur le nouveau avant l'échange.
+"""
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import search_keys
+
+AUTOCOMPLETE_REFRESH_SECONDS = int(os.getenv("AUTOCOMPLETE_REFRESH_SECONDS", "300"))
+# Nombre max. de clés examinées pour une requête (préfixes très courts)
+_MAX_SCAN = 5000
+
+
+class _Patient:
+    __slots__ = ("patient_id", "label", "keys")
+
+    def __init__(self, patient_id, label, keys):
+        self.patient_id = patient_id
+        self.label = label
+        self.keys = keys
+
+
+def _digits(text):
+    return "".join(c for c in (text or "") if c.isdigit())
+
+
+def _patient_keys(nom, prenom, telephone):
+    keys = search_keys.patient_search_keys(nom, prenom)
+    phone = _digits(telephone)
+    if phone:
+        keys.append(phone)
+    return tuple(keys)
+
+
+def _label(nom, prenom, telephone):
+    return f"{nom} {prenom} (Tel: {telephone or 'N/A'})"
+
+
+class PatientAutocomplete:
+    """Recherche par préfixe en mémoire sur les noms et téléphones des patients."""
+
+    def __init__(self, refresh_seconds=AUTOCOMPLETE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.loaded_at = None
+        self._keys = []
+        self._refs = array("I")
+        self._patients = []
+        self._by_id = {}
+        self._lock = threading.Lock()
+        self._force_reload = False
+        # Mises à jour reçues pendant un rechargement (None hors rechargement)
+        self._pending = None
+
+    def is_stale(self):
+        return (self.loaded_at is None or self._force_reload
+                or time.monotonic() - self.loaded_at > self.refresh_seconds)
+
+    def load(self, patients):
+        """(Re)construit l'index à partir d'un itérable de documents {_id, nom, prenom, telephone}.
+
+        L'index courant reste utilisable pendant la construction.
+        """
+        with self._lock:
+            self._pending = []
+            self._force_reload = False
+        entries, table, by_id = [], [], {}
+        try:
+            for pat in patients:
+                nom, prenom, tel = pat.get("nom", ""), pat.get("prenom", ""), pat.get("telephone", "")
+                ref = len(table)
+                record = _Patient(pat["_id"], _label(nom, prenom, tel), _patient_keys(nom, prenom, tel))
+                table.append(record)
+                by_id[pat["_id"]] = ref
+                entries.extend((key, ref) for key in record.keys)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        entries.sort()
+        keys = [key for key, _ in entries]
+        refs = array("I", (ref for _, ref in entries))
+        with self._lock:
+            self._keys, self._refs, self._patients, self._by_id = keys, refs, table, by_id
+            pending, self._pending = self._pending, None
+            for args in pending:
+                self._upsert(*args)
+            self.loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Force un rechargement complet à la prochaine recherche (après un import en masse).
+
+        L'index actuel continue de servir jusqu'à la fin du rechargement.
+        """
+        self._force_reload = True
+
+    def upsert(self, patient_id, nom, prenom, telephone):
+        """Ajoute ou remplace un patient (sans effet tant que l'index n'est pas chargé)."""
+        if self.loaded_at is None and self._pending is None:
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((patient_id, nom, prenom, telephone))
+            if self.loaded_at is not None:
+                self._upsert(patient_id, nom, prenom, telephone)
+
+    def _upsert(self, patient_id, nom, prenom, telephone):
+        """Ajout d'une fiche, appelé verrou pris."""
+        record = _Patient(patient_id, _label(nom, prenom, telephone), _patient_keys(nom, prenom, telephone))
+        old_ref = self._by_id.get(patient_id)
+        if old_ref is not None:
+            self._patients[old_ref] = None
+        ref = len(self._patients)
+        self._patients.append(record)
+        self._by_id[patient_id] = ref
+        for key in record.keys:
+            pos = bisect_left(self._keys, key)
+            self._keys.insert(pos, key)
+            self._refs.insert(pos, ref)
+
+    def lookup(self, text, k=8):
+        """Jusqu'à `k` suggestions [(patient_id, libellé)] dont chaque mot saisi préfixe une clé."""
+        phone = _digits(text)
+        if phone and not any(c.isalpha() for c in text):
+            tokens = [phone]
+        else:
+            tokens = search_keys.tokenize(text)
+        if not tokens:
+            return []
+        first, others = tokens[0], tokens[1:]
+
+        results, seen = [], set()
+        with self._lock:
+            pos = bisect_left(self._keys, first)
+            end = min(len(self._keys), pos + _MAX_SCAN)
+            while pos < end and self._keys[pos].startswith(first):
+                ref = self._refs[pos]
+                pos += 1
+                record = self._patients[ref]
+                if record is None or ref in seen:
+                    continue
+                seen.add(ref)
+                if all(any(key.startswith(t) for key in record.keys) for t in others):
+                    results.append((record.patient_id, record.label))
+                    if len(results) >= k:
+                        break
+        return results
+
+    def __len__(self):
+        return len(self._by_id)
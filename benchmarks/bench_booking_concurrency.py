@@ -0,0 +1,105 @@
+"""Test de charge : réservations concurrentes sans double réservation.
+
+Lance des centaines de `create_appointment` en parallèle (plusieurs threads, donc
+plusieurs connexions du pool) sur quelques praticiens et une seule journée, de sorte
+que beaucoup de demandes se disputent les mêmes créneaux. Vérifie ensuite qu'aucun
+couple de RDV actifs d'un même praticien ne se chevauche et affiche le débit obtenu.
+
+Usage (sur une base jetable, jamais sur la base de production) :
+    MONGO_DB_NAME=medigest_bench python benchmarks/bench_booking_concurrency.py --bookings 500 --workers 32
+
+Code de sortie 1 si un chevauchement est détecté.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db_manager import DB_NAME, DBManager  # noqa: E402
+
+
+def find_overlaps(appointments):
+    """Couples de RDV actifs qui se chevauchent, par praticien."""
+    by_practitioner = {}
+    for appt in appointments:
+        by_practitioner.setdefault(appt["practitioner_id"], []).append(appt)
+    overlaps = []
+    for appts in by_practitioner.values():
+        appts.sort(key=lambda a: a["date_heure_debut"])
+        for prev, cur in zip(appts, appts[1:]):
+            if cur["date_heure_debut"] < prev["date_heure_fin"]:
+                overlaps.append((prev["_id"], cur["_id"]))
+    return overlaps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bookings", type=int, default=500, help="Nombre de demandes de RDV")
+    parser.add_argument("--workers", type=int, default=32, help="Nombre de threads concurrents")
+    parser.add_argument("--practitioners", type=int, default=3, help="Nombre de praticiens sollicités")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if DB_NAME == "medigest_db":
+        print("Refus : définir MONGO_DB_NAME sur une base jetable (elle est vidée).", file=sys.stderr)
+        return 2
+
+    manager = DBManager()
+    if manager.db is None:
+        print("Impossible de se connecter à MongoDB.", file=sys.stderr)
+        return 2
+    for name in ("appointments", "patients", "reservations", "slot_bitmaps", "stats"):
+        manager.db[name].delete_many({})
+    manager.db.practitioners.delete_many({"nom": {"$regex": "^Dr. Bench "}})
+
+    manager.create_patient("Bench", "Patient", "0600000000", "", "", "", "bench")
+    patient_id = manager.db.patients.find_one({"nom": "BENCH"}, {"_id": 1})["_id"]
+    for i in range(args.practitioners):
+        manager.create_practitioner(f"Dr. Bench {i}", "Généraliste", "bench")
+    practitioners = [p["_id"] for p in manager.get_practitioners() if p["nom"].startswith("Dr. Bench ")]
+
+    # Demain de 8h à 18h, créneaux de 15 min : beaucoup plus de demandes que de places
+    rng = random.Random(args.seed)
+    day_start = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time(8))
+    requests = [
+        (rng.choice(practitioners),
+         day_start + datetime.timedelta(minutes=15 * rng.randrange(40)),
+         rng.choice((15, 30, 45)))
+        for _ in range(args.bookings)
+    ]
+
+    def book(request):
+        practitioner, start, duration = request
+        ok, _ = manager.create_appointment(patient_id, practitioner, start, duration, "bench", "bench")
+        return ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(book, requests))
+    elapsed = time.perf_counter() - started
+
+    active = list(manager.db.appointments.find(
+        {"is_active": True}, {"practitioner_id": 1, "date_heure_debut": 1, "date_heure_fin": 1}
+    ))
+    overlaps = find_overlaps(active)
+    accepted = sum(results)
+
+    print(f"Demandes : {len(requests)} ({args.workers} threads, {args.practitioners} praticiens)")
+    print(f"Acceptées : {accepted} / refusées : {len(requests) - accepted}")
+    print(f"RDV actifs en base : {len(active)}")
+    print(f"Durée : {elapsed:.2f} s, débit : {len(requests) / elapsed:.0f} demandes/s")
+    print(f"Chevauchements : {len(overlaps)}")
+    if overlaps or len(active) != accepted:
+        for pair in overlaps[:10]:
+            print(f"  {pair[0]} <-> {pair[1]}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
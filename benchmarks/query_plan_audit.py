@@ -0,0 +1,255 @@
+"""Audit des plans d'exécution des requêtes émises par DBManager.
+
+Rejoue les scénarios de `run_benchmarks.py` sur une base jetable en capturant chaque
+commande de lecture ou d'écriture ciblée (find, aggregate, count, distinct, update,
+delete, findAndModify) émise par une méthode de DBManager. Les commandes sont
+regroupées par forme (collection, type, champs et opérateurs du filtre, tri ; sans les
+valeurs), puis chaque forme est passée à `explain` en mode « executionStats » :
+
+* COLLSCAN : parcours complet de la collection ;
+* SORT : tri en mémoire (aucun index ne fournit l'ordre demandé) ;
+* ratio documents examinés / renvoyés au-delà de --max-ratio.
+
+Le rapport est enregistré en JSON. Avec --baseline, toute forme qui passe à un COLLSCAN
+ou à un tri en mémoire (ou qui apparaît directement ainsi) est signalée par un diff et
+le script sort en erreur.
+
+Usage (jamais sur la base de production : elle est vidée) :
+    MONGO_DB_NAME=medigest_bench python benchmarks/query_plan_audit.py --output plans_reference.json
+    MONGO_DB_NAME=medigest_bench python benchmarks/query_plan_audit.py --skip-seed --baseline plans_reference.json
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pymongo import MongoClient, monitoring  # noqa: E402
+
+import query_monitor  # noqa: E402
+from db_manager import DB_NAME, MONGO_CLIENT_OPTIONS, MONGO_URI, DBManager  # noqa: E402
+from run_benchmarks import build_cases, git_revision, seed  # noqa: E402
+
+EXPLAINABLE = ("find", "aggregate", "count", "distinct", "update", "delete", "findAndModify")
+# Champs de session / transport à retirer avant de rejouer la commande dans explain
+_TRANSPORT_FIELDS = ("lsid", "$db", "$clusterTime", "txnNumber", "$readPreference", "readConcern", "writeConcern")
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Garde une commande par forme, avec la méthode DBManager qui l'a émise."""
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.commands = {}
+
+    def started(self, event):
+        operation = query_monitor.current_operation()
+        if event.command_name not in EXPLAINABLE or event.database_name != self.db_name or operation is None:
+            return
+        command = copy.deepcopy(dict(event.command))
+        for field in _TRANSPORT_FIELDS:
+            command.pop(field, None)
+        # explain n'accepte qu'une instruction par update / delete
+        for batch in ("updates", "deletes"):
+            if batch in command:
+                command[batch] = command[batch][:1]
+        key = shape_key(event.command_name, command)
+        entry = self.commands.setdefault(key, {"command": command, "operations": set()})
+        entry["operations"].add(operation)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def shape(value):
+    """Forme d'une expression de requête : champs et opérateurs conservés, valeurs masquées."""
+    if isinstance(value, dict):
+        return {k: shape(v) for k, v in value.items()}
+    if isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+        return [shape(v) for v in value]
+    return "?"
+
+
+def _pipeline_shape(pipeline):
+    stages = []
+    for stage in pipeline or []:
+        name = next(iter(stage), "?")
+        stages.append({name: shape(stage[name])} if name in ("$match", "$sort") else name)
+    return stages
+
+
+def shape_key(command_name, command):
+    collection = command.get(command_name)
+    if command_name == "find":
+        detail = {"filter": shape(command.get("filter", {})), "sort": command.get("sort")}
+    elif command_name == "count":
+        detail = {"filter": shape(command.get("query", {}))}
+    elif command_name == "distinct":
+        detail = {"key": command.get("key"), "filter": shape(command.get("query", {}))}
+    elif command_name == "aggregate":
+        detail = {"pipeline": _pipeline_shape(command.get("pipeline"))}
+    elif command_name == "findAndModify":
+        detail = {"filter": shape(command.get("query", {})), "sort": command.get("sort")}
+    else:
+        statement = (command.get("updates") or command.get("deletes") or [{}])[0]
+        detail = {"filter": shape(statement.get("q", {}))}
+    return f"{collection}.{command_name} {json.dumps(detail, sort_keys=True, ensure_ascii=False, default=str)}"
+
+
+def _walk(node, found):
+    """Collecte les étages (stage, indexName) et les executionStats d'une sortie d'explain."""
+    if isinstance(node, dict):
+        if "stage" in node and isinstance(node["stage"], str):
+            found["stages"].append(node["stage"])
+            if node.get("indexName"):
+                found["indexes"].add(node["indexName"])
+        if "executionStats" in node and found["stats"] is None:
+            found["stats"] = node["executionStats"]
+        for key, child in node.items():
+            # Les plans rejetés ne disent rien du plan réellement exécuté
+            if key not in ("rejectedPlans", "allPlansExecution"):
+                _walk(child, found)
+    elif isinstance(node, list):
+        for child in node:
+            _walk(child, found)
+
+
+def analyse(explain_output, max_ratio):
+    found = {"stages": [], "indexes": set(), "stats": None}
+    _walk(explain_output, found)
+    stats = found["stats"] or {}
+    examined = stats.get("totalDocsExamined", 0)
+    returned = stats.get("nReturned", 0)
+    ratio = examined / returned if returned else float(examined)
+    flags = []
+    if "COLLSCAN" in found["stages"]:
+        flags.append("COLLSCAN")
+    if "SORT" in found["stages"]:
+        flags.append("SORT")
+    if ratio > max_ratio:
+        flags.append("RATIO")
+    return {
+        "stages": sorted(set(found["stages"])),
+        "indexes": sorted(found["indexes"]),
+        "docs_examined": examined,
+        "keys_examined": stats.get("totalKeysExamined", 0),
+        "returned": returned,
+        "ratio": round(ratio, 1),
+        "flags": flags,
+    }
+
+
+def audit(db, recorder, max_ratio):
+    plans = {}
+    for key, entry in sorted(recorder.commands.items()):
+        result = {"operations": sorted(entry["operations"])}
+        try:
+            output = db.command({"explain": entry["command"], "verbosity": "executionStats"})
+            result.update(analyse(output, max_ratio))
+        except Exception as e:
+            result.update({"error": str(e), "flags": ["ERROR"]})
+        plans[key] = result
+    return plans
+
+
+def regressions(plans, baseline):
+    """Formes qui introduisent un COLLSCAN ou un tri en mémoire absents de la référence."""
+    found = []
+    for key, plan in plans.items():
+        new_flags = {"COLLSCAN", "SORT"} & set(plan["flags"])
+        ref = baseline.get(key)
+        if ref is not None:
+            new_flags -= set(ref["flags"])
+        if new_flags:
+            found.append((key, ref, plan, sorted(new_flags)))
+    return found
+
+
+def _describe(plan):
+    if plan is None:
+        return "absente de la référence"
+    if "error" in plan:
+        return f"erreur : {plan['error']}"
+    indexes = ", ".join(plan["indexes"]) or "aucun index"
+    return (f"{'+'.join(plan['stages'])} ({indexes}), {plan['docs_examined']} doc(s) examiné(s) "
+            f"pour {plan['returned']} renvoyé(s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--appointments", type=int, default=10000)
+    parser.add_argument("--logs", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3, help="Appels par scénario pour capturer les formes")
+    parser.add_argument("--skip-seed", action="store_true", help="Réutilise les données déjà en base")
+    parser.add_argument("--max-ratio", type=float, default=100.0, help="Ratio examinés / renvoyés toléré")
+    parser.add_argument("--output", default="query_plans.json")
+    parser.add_argument("--baseline", help="Rapport JSON de référence")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if DB_NAME == "medigest_db":
+        print("Refus : définir MONGO_DB_NAME sur une base jetable (elle est vidée).", file=sys.stderr)
+        return 2
+
+    recorder = CommandRecorder(DB_NAME)
+    client = MongoClient(MONGO_URI, event_listeners=[recorder], **MONGO_CLIENT_OPTIONS)
+    manager = DBManager(client=client, db_name=DB_NAME)
+    if manager.db is None:
+        print("Impossible de se connecter à MongoDB.", file=sys.stderr)
+        return 2
+
+    rng = random.Random(args.seed)
+    if not args.skip_seed:
+        seed(manager, args.patients, args.appointments, args.logs, rng)
+    recorder.commands.clear()
+    for _, fn in build_cases(manager, rng, calls=args.repeat):
+        for _ in range(args.repeat):
+            fn()
+    manager.audit.close()
+
+    plans = audit(manager.db, recorder, args.max_ratio)
+    for key, plan in plans.items():
+        marker = " ".join(plan["flags"]) or "ok"
+        print(f"[{marker:^14}] {key}")
+        print(f"                 {', '.join(plan['operations'])} : {_describe(plan)}")
+    flagged = sum(1 for p in plans.values() if p["flags"])
+    print(f"\n{len(plans)} forme(s) de requête, {flagged} signalée(s)")
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "server": client.server_info().get("version"),
+            "max_ratio": args.max_ratio,
+        },
+        "plans": plans,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Rapport enregistré dans {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["plans"]
+        found = regressions(plans, baseline)
+        if found:
+            print(f"\n{len(found)} régression(s) de plan :", file=sys.stderr)
+            for key, ref, plan, new_flags in found:
+                print(f"  {key}  [{', '.join(new_flags)}]", file=sys.stderr)
+                print(f"    - référence : {_describe(ref)}", file=sys.stderr)
+                print(f"    + actuel    : {_describe(plan)}", file=sys.stderr)
+            return 1
+        print("Aucune régression par rapport à la référence.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
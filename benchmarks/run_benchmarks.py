@@ -0,0 +1,382 @@
+"""Banc de mesure des méthodes publiques de DBManager sur des volumes réalistes.
+
+Remplit une base jetable (patients, RDV, visites, logs) puis chronomètre chaque
+méthode publique : latences p50 / p95 / p99 et nombre d'allers-retours serveur par
+appel (commandes MongoDB émises par le thread appelant, comptées par un
+CommandListener). Les résultats sont enregistrés en JSON pour comparer deux commits.
+
+Usage (jamais sur la base de production : elle est vidée) :
+    MONGO_DB_NAME=medigest_bench python benchmarks/run_benchmarks.py --patients 100000 --appointments 200000
+    MONGO_DB_NAME=medigest_bench python benchmarks/run_benchmarks.py --skip-seed --output apres.json --compare avant.json
+
+Code de sortie 1 si --compare signale une régression au-delà de --max-regression.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bson.objectid import ObjectId  # noqa: E402
+from pymongo import MongoClient, monitoring  # noqa: E402
+
+from appointment_status import status_fields  # noqa: E402
+from db_manager import DB_NAME, MONGO_CLIENT_OPTIONS, MONGO_URI, DBManager, build_patient_doc  # noqa: E402
+
+STATUSES = ["Confirmé"] * 8 + ["Absent", "Annulé"]
+FIRST_NAMES = ["Jean", "Marie", "Hélène", "Luc", "Sophie", "Éloïse", "Paul", "Inès", "Hugo", "Chloé"]
+LAST_NAMES = ["Dupont", "Martin", "Bernard", "Durand", "Lefèvre", "Moreau", "Garnier", "Faure", "Roux", "Blanc"]
+MOTIFS = ["Consultation", "Suivi", "Vaccin", "Bilan", "Urgence"]
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """Compte les commandes envoyées au serveur, par thread (le thread d'audit est ignoré)."""
+
+    def __init__(self):
+        self._counts = {}
+
+    def started(self, event):
+        ident = threading.get_ident()
+        self._counts[ident] = self._counts.get(ident, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def current(self):
+        return self._counts.get(threading.get_ident(), 0)
+
+
+# --- Jeu de données ---
+
+def seed(manager, n_patients, n_appointments, n_logs, rng, batch_size=5000):
+    """Vide la base puis insère les volumes demandés par lots."""
+    db = manager.db
+    for name in ("patients", "appointments", "visits", "logs", "reservations", "slot_bitmaps", "stats"):
+        db[name].delete_many({})
+    practitioners = manager.get_practitioners()
+
+    patient_ids = []
+    batch = []
+    for i in range(n_patients):
+        doc = build_patient_doc(f"{rng.choice(LAST_NAMES)}{i}", rng.choice(FIRST_NAMES), f"06{i:08d}",
+                                f"patient{i}@exemple.fr", f"{i:013d}", "RAS")
+        doc["_id"] = ObjectId()
+        patient_ids.append(doc["_id"])
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            db.patients.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.patients.insert_many(batch, ordered=False)
+
+    # RDV de 30 min répartis sur un an passé et trois mois à venir (au-delà si le volume
+    # l'exige), créneaux distincts par praticien
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time(8))
+    slots_per_day = 20
+    days_needed = -(-n_appointments // (len(practitioners) * slots_per_day))
+    day_stride = max(1, (365 + 90) // max(days_needed, 1))
+    appts, visits = [], []
+    for i in range(n_appointments):
+        practitioner = practitioners[i % len(practitioners)]
+        slot = i // len(practitioners)
+        day_offset = (slot // slots_per_day) * day_stride - 365
+        start = today + datetime.timedelta(days=day_offset, minutes=30 * (slot % slots_per_day))
+        statut = rng.choice(STATUSES)
+        patient_id = rng.choice(patient_ids)
+        appt_id = ObjectId()
+        appts.append({
+            "_id": appt_id,
+            "patient_id": patient_id,
+            "practitioner_id": practitioner["_id"],
+            "practitioner_name": practitioner["nom"],
+            "date_heure_debut": start,
+            "date_heure_fin": start + datetime.timedelta(minutes=30),
+            "duree_minutes": 30,
+            "motif": rng.choice(MOTIFS),
+            **status_fields(statut),
+            "created_at": start - datetime.timedelta(days=7)
+        })
+        visits.append({"patient_id": patient_id, "appointment_id": appt_id, "date": start,
+                       "practitioner_id": practitioner["_id"], "practitioner": practitioner["nom"],
+                       "motif": appts[-1]["motif"]})
+        if len(appts) >= batch_size:
+            db.appointments.insert_many(appts, ordered=False)
+            db.visits.insert_many(visits, ordered=False)
+            appts, visits = [], []
+    if appts:
+        db.appointments.insert_many(appts, ordered=False)
+        db.visits.insert_many(visits, ordered=False)
+
+    logs = []
+    now = datetime.datetime.now()
+    for i in range(n_logs):
+        logs.append({
+            "user": rng.choice(["admin", "accueil1", "accueil2", "responsable"]),
+            "action": rng.choice(["CREATE_APPT", "UPDATE_APPT", "CREATE_PATIENT", "LOGIN"]),
+            "details": f"Entrée {i}",
+            "timestamp": now - datetime.timedelta(seconds=rng.randrange(60 * 86400))
+        })
+        if len(logs) >= batch_size:
+            db.logs.insert_many(logs, ordered=False)
+            logs = []
+    if logs:
+        db.logs.insert_many(logs, ordered=False)
+
+    manager.rebuild_stats()
+    manager.rebuild_schedule()
+
+
+# --- Scénarios ---
+
+def build_cases(manager, rng, calls=1):
+    """(nom, fonction sans argument) pour chaque méthode publique mesurée.
+
+    `calls` : nombre d'appels prévus par scénario, échauffement compris. Les méthodes
+    destructrices (suppressions) consomment des documents jetables créés en lot au
+    premier appel, c'est-à-dire pendant l'échauffement, hors mesure.
+    """
+    db = manager.db
+    practitioners = [p["_id"] for p in manager.get_practitioners()]
+    sample = list(db.patients.aggregate([{"$sample": {"size": 200}}, {"$project": {"nom": 1, "prenom": 1}}]))
+    patient_ids = [p["_id"] for p in sample]
+    today = datetime.date.today()
+    now = datetime.datetime.now()
+    future_ids = [a["_id"] for a in db.appointments.find(
+        {"date_heure_debut": {"$gt": now + datetime.timedelta(days=2)}, "is_active": True}, {"_id": 1}
+    ).limit(500)]
+    # Créneaux libres pour les créations : un jour lointain, un créneau par appel
+    free_start = datetime.datetime.combine(today + datetime.timedelta(days=400), datetime.time(6))
+    counter = {"create": 0}
+
+    def next_free_slot():
+        counter["create"] += 1
+        return free_start + datetime.timedelta(minutes=15 * counter["create"])
+
+    def prefix():
+        pat = rng.choice(sample)
+        return pat["nom"][:3]
+
+    def unique(kind):
+        counter[kind] = counter.get(kind, 0) + 1
+        return counter[kind]
+
+    disposable = {"practitioners": [], "appointments": []}
+
+    def disposable_practitioner():
+        pool = disposable["practitioners"]
+        if not pool:
+            # Praticiens laissés par create_practitioner, complétés jusqu'à `calls`
+            pool.extend(p["_id"] for p in db.practitioners.find({"nom": {"$regex": "^Dr. Jetable "}}, {"_id": 1}))
+            missing = max(calls - len(pool), 0 if pool else 1)
+            if missing:
+                pool.extend(db.practitioners.insert_many([
+                    {"nom": f"Dr. Jetable {i}", "specialite": "Bench", "created_at": now} for i in range(missing)
+                ]).inserted_ids)
+                manager.reference.invalidate("practitioners")
+        return pool.pop()
+
+    def disposable_appointment():
+        pool = disposable["appointments"]
+        if not pool:
+            # RDV créés par DBManager (réservation et compteurs compris) pour que la
+            # suppression libère un vrai créneau
+            day = datetime.datetime.combine(today + datetime.timedelta(days=800), datetime.time(6))
+            for _ in range(calls):
+                start = day + datetime.timedelta(minutes=15 * unique("disposable_appt"))
+                manager.create_appointment(rng.choice(patient_ids), practitioners[0], start, 15, "jetable", "bench")
+            pool.extend(a["_id"] for a in db.appointments.find({"motif": "jetable"}, {"_id": 1}))
+        return pool.pop()
+
+    renamed = manager.get_practitioners()[0]
+
+    window_start = datetime.datetime.combine(today, datetime.time.min)
+    window_end = window_start + datetime.timedelta(days=7)
+    overlap_start = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time(10))
+
+    cases = [
+        ("check_user", lambda: manager.check_user("admin", "admin123")),
+        ("get_all_users", lambda: manager.get_all_users()),
+        ("log_action", lambda: manager.log_action("bench", "BENCH", "mesure")),
+        ("get_logs", lambda: manager.get_logs()),
+        ("get_logs_page", lambda: manager.get_logs_page()),
+        ("get_logs_page[user]", lambda: manager.get_logs_page(user="admin")),
+        ("get_log_filter_values", lambda: manager.get_log_filter_values()),
+        ("search_patients", lambda: manager.search_patients(prefix())),
+        ("search_patient_summaries", lambda: manager.search_patient_summaries(prefix())),
+        ("search_patients[id]", lambda: manager.search_patients(str(rng.choice(patient_ids)))),
+        ("autocomplete_patients", lambda: manager.autocomplete_patients(prefix())),
+        ("get_patient", lambda: manager.get_patient(rng.choice(patient_ids))),
+        ("get_patient_visits", lambda: manager.get_patient_visits(rng.choice(patient_ids))),
+        ("create_patient", lambda: manager.create_patient("Bench", "Patient", "0600000000", "", "", "", "bench")),
+        ("update_patient", lambda: manager.update_patient(rng.choice(patient_ids), {"email": "maj@exemple.fr"}, "bench")),
+        ("get_practitioners", lambda: manager.get_practitioners()),
+        ("check_appointment_overlap", lambda: manager.check_appointment_overlap(
+            rng.choice(practitioners), overlap_start, overlap_start + datetime.timedelta(minutes=30))),
+        ("find_free_slots[7j]", lambda: manager.find_free_slots(today, today + datetime.timedelta(days=6), 30)),
+        ("create_appointment", lambda: manager.create_appointment(
+            rng.choice(patient_ids), rng.choice(practitioners), next_free_slot(), 15, "bench", "bench")),
+        ("create_appointment_series[8]", lambda: manager.create_appointment_series(
+            rng.choice(patient_ids), rng.choice(practitioners), next_free_slot() + datetime.timedelta(days=200),
+            15, "bench", "bench", count=8)),
+        ("update_appointment_status", lambda: manager.update_appointment_status(
+            rng.choice(future_ids), rng.choice(["Confirmé", "Absent"]), "bench")),
+        ("reschedule_appointment", lambda: manager.reschedule_appointment(
+            rng.choice(future_ids), next_free_slot(), 15, "bench")),
+        ("get_appointments[jour]", lambda: manager.get_appointments(today)),
+        ("count_appointments_by_practitioner", lambda: manager.count_appointments_by_practitioner(window_start, window_end)),
+        ("get_practitioner_appointments", lambda: manager.get_practitioner_appointments(
+            rng.choice(practitioners), window_start, window_end)),
+        ("get_stats_cancellation_rate", lambda: manager.get_stats_cancellation_rate()),
+        ("get_stats_workload", lambda: manager.get_stats_workload()),
+        ("get_dashboard_stats", lambda: manager.get_dashboard_stats()),
+        # Écritures sur les données de référence : en fin de liste, car elles changent les
+        # praticiens vus par les scénarios précédents
+        ("create_user", lambda: manager.create_user(f"bench_{unique('user')}", "bench", "Accueil", "bench")),
+        ("create_practitioner", lambda: manager.create_practitioner(f"Dr. Jetable c{unique('practitioner')}", "Bench", "bench")),
+        # Renommage d'un praticien ayant des RDV : recopie du nom dans appointments et visits
+        ("update_practitioner", lambda: manager.update_practitioner(
+            renamed["_id"], {"nom": renamed["nom"] + (" (renommé)" if unique("rename") % 2 else "")}, "bench")),
+        ("delete_practitioner", lambda: manager.delete_practitioner(disposable_practitioner(), "bench")),
+        ("delete_appointment", lambda: manager.delete_appointment(disposable_appointment(), "bench")),
+        ("rebuild_stats", lambda: manager.rebuild_stats()),
+        ("rebuild_schedule", lambda: manager.rebuild_schedule()),
+    ]
+    if not future_ids:
+        # Pas de RDV à venir dans le jeu de données : rien à modifier
+        cases = [c for c in cases if c[0] not in ("update_appointment_status", "reschedule_appointment")]
+    return cases
+
+
+def percentile(sorted_values, q):
+    """Percentile par rang le plus proche (q entre 0 et 100)."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def measure(fn, repeat, counter):
+    fn()  # échauffement (caches, autocomplétion chargée une fois)
+    timings, trips = [], []
+    for _ in range(repeat):
+        before = counter.current()
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        trips.append(counter.current() - before)
+    timings.sort()
+    return {
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "round_trips": round(sum(trips) / len(trips), 2),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, max_regression):
+    """Affiche l'écart au résultat de référence ; retourne les méthodes en régression."""
+    regressions = []
+    print(f"\n{'Méthode':40} {'p50 réf.':>10} {'p50':>10} {'écart':>8} {'A/R réf.':>9} {'A/R':>6}")
+    for name, current in results.items():
+        ref = baseline.get(name)
+        if not ref:
+            print(f"{name:40} {'-':>10} {current['p50_ms']:>10.2f} {'nouveau':>8}")
+            continue
+        delta = (current["p50_ms"] - ref["p50_ms"]) / ref["p50_ms"] * 100 if ref["p50_ms"] else 0.0
+        flag = ""
+        if delta > max_regression or current["round_trips"] > ref["round_trips"]:
+            regressions.append(name)
+            flag = "  <-- régression"
+        print(f"{name:40} {ref['p50_ms']:>10.2f} {current['p50_ms']:>10.2f} {delta:>+7.1f}% "
+              f"{ref['round_trips']:>9} {current['round_trips']:>6}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--appointments", type=int, default=10000)
+    parser.add_argument("--logs", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=50, help="Appels mesurés par méthode")
+    parser.add_argument("--skip-seed", action="store_true", help="Réutilise les données déjà en base")
+    parser.add_argument("--only", nargs="*", help="Méthodes à mesurer (toutes par défaut)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Fichier JSON de référence")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Écart p50 toléré (%%)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if DB_NAME == "medigest_db":
+        print("Refus : définir MONGO_DB_NAME sur une base jetable (elle est vidée).", file=sys.stderr)
+        return 2
+
+    counter = RoundTripCounter()
+    client = MongoClient(MONGO_URI, event_listeners=[counter], **MONGO_CLIENT_OPTIONS)
+    manager = DBManager(client=client, db_name=DB_NAME)
+    if manager.db is None:
+        print("Impossible de se connecter à MongoDB.", file=sys.stderr)
+        return 2
+
+    rng = random.Random(args.seed)
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed(manager, args.patients, args.appointments, args.logs, rng)
+        print(f"Données insérées en {time.perf_counter() - started:.1f} s")
+
+    volumes = {name: manager.db[name].estimated_document_count() for name in ("patients", "appointments", "visits", "logs")}
+    print("Volumes : " + ", ".join(f"{k}={v}" for k, v in volumes.items()))
+
+    results = {}
+    for name, fn in build_cases(manager, rng, calls=args.repeat + 1):
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(fn, args.repeat, counter)
+        r = results[name]
+        print(f"{name:40} p50 {r['p50_ms']:>9.2f} ms  p95 {r['p95_ms']:>9.2f} ms  "
+              f"p99 {r['p99_ms']:>9.2f} ms  A/R {r['round_trips']}")
+    manager.audit.close()
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "server": client.server_info().get("version"),
+            "volumes": volumes,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultats enregistrés dans {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} régression(s) : {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
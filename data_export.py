@@ -0,0 +1,232 @@
+"""Export en flux des patients, RDV et logs vers CSV ou Parquet.
+
+Le curseur MongoDB est lu par lots de `batch_size` documents ; chaque lot est
+converti en lignes plates puis écrit aussitôt (lignes CSV, ou un groupe de lignes
+Parquet par lot). La mémoire utilisée reste celle d'un lot, quel que soit le
+volume exporté : aucun DataFrame de l'ensemble n'est construit.
+
+Parquet nécessite `pyarrow` (importé seulement pour ce format).
+"""
+import csv
+import datetime
+import io
+import os
+import tempfile
+import time
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+# Fichiers d'export préparés dans l'interface, en attente de téléchargement
+EXPORT_SPOOL_DIR = os.getenv("EXPORT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "medigest_exports"))
+# Âge au-delà duquel un fichier d'export abandonné (onglet fermé, session expirée) est supprimé
+EXPORT_SPOOL_TTL_MINUTES = int(os.getenv("EXPORT_SPOOL_TTL_MINUTES", "60"))
+
+# Jeu de données -> collection, champ de date filtré, ordre de lecture (champ indexé),
+# champ praticien, colonnes (nom, type). Les notes médicales ne sont pas exportées.
+DATASETS = {
+    "patients": {
+        "collection": "patients",
+        "date_field": "created_at",
+        "sort_field": "_id",
+        "practitioner_field": None,
+        "columns": [
+            ("_id", "string"), ("nom", "string"), ("prenom", "string"), ("telephone", "string"),
+            ("email", "string"), ("assurance", "string"), ("created_at", "timestamp"),
+        ],
+    },
+    "appointments": {
+        "collection": "appointments",
+        "date_field": "date_heure_debut",
+        "sort_field": "date_heure_debut",
+        "practitioner_field": "practitioner_id",
+        "columns": [
+            ("_id", "string"), ("patient_id", "string"), ("practitioner_id", "string"), ("practitioner_name", "string"),
+            ("date_heure_debut", "timestamp"), ("date_heure_fin", "timestamp"), ("duree_minutes", "int"),
+            ("motif", "string"), ("statut", "string"), ("statut_code", "string"), ("is_active", "bool"),
+            ("created_at", "timestamp"),
+        ],
+    },
+    "logs": {
+        "collection": "logs",
+        "date_field": "timestamp",
+        "sort_field": "timestamp",
+        "practitioner_field": None,
+        "columns": [
+            ("_id", "string"), ("timestamp", "timestamp"), ("user", "string"),
+            ("action", "string"), ("details", "string"),
+        ],
+    },
+}
+
+FORMATS = {"csv": ".csv", "parquet": ".parquet"}
+
+
+def build_query(dataset, date_from=None, date_to=None, practitioner=None):
+    """Filtre MongoDB du jeu de données : période [date_from, date_to[ et praticien (identifiant)."""
+    spec = DATASETS[dataset]
+    query = {}
+    date_range = {}
+    if date_from:
+        date_range["$gte"] = date_from
+    if date_to:
+        date_range["$lt"] = date_to
+    if date_range:
+        query[spec["date_field"]] = date_range
+    if practitioner:
+        if not spec["practitioner_field"]:
+            raise ValueError(f"Le filtre praticien ne s'applique pas à « {dataset} »")
+        query[spec["practitioner_field"]] = ObjectId(practitioner)
+    return query
+
+
+def _flat(value):
+    return str(value) if isinstance(value, ObjectId) else value
+
+
+def iter_batches(db, dataset, query, batch_size=EXPORT_BATCH_SIZE):
+    """Génère des listes d'au plus `batch_size` lignes (dict colonne -> valeur)."""
+    spec = DATASETS[dataset]
+    names = [name for name, _ in spec["columns"]]
+    cursor = (
+        db[spec["collection"]]
+        .find(query, {name: 1 for name in names})
+        .sort(spec["sort_field"], ASCENDING)
+        .batch_size(batch_size)
+    )
+    batch = []
+    for doc in cursor:
+        batch.append({name: _flat(doc.get(name)) for name in names})
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_csv(batches, stream, dataset):
+    """Écrit les lots dans un flux texte CSV ; retourne le nombre de lignes."""
+    names = [name for name, _ in DATASETS[dataset]["columns"]]
+    writer = csv.DictWriter(stream, fieldnames=names)
+    writer.writeheader()
+    rows = 0
+    for batch in batches:
+        writer.writerows(batch)
+        rows += len(batch)
+    return rows
+
+
+def write_csv_chunks(batches, path, dataset, chunk_rows):
+    """Écrit des fichiers CSV d'au plus `chunk_rows` lignes (<path>_part0001.csv, ...).
+
+    Retourne (nombre de lignes, chemins écrits).
+    """
+    names = [name for name, _ in DATASETS[dataset]["columns"]]
+    base, ext = os.path.splitext(path)
+    paths, rows = [], 0
+    stream, writer, in_chunk = None, None, 0
+    try:
+        for batch in batches:
+            for row in batch:
+                if writer is None or in_chunk >= chunk_rows:
+                    if stream is not None:
+                        stream.close()
+                    paths.append(f"{base}_part{len(paths) + 1:04d}{ext or '.csv'}")
+                    stream = open(paths[-1], "w", encoding="utf-8", newline="")
+                    writer = csv.DictWriter(stream, fieldnames=names)
+                    writer.writeheader()
+                    in_chunk = 0
+                writer.writerow(row)
+                in_chunk += 1
+                rows += 1
+    finally:
+        if stream is not None:
+            stream.close()
+    return rows, paths
+
+
+def _arrow_schema(dataset):
+    import pyarrow as pa
+
+    types = {"string": pa.string(), "timestamp": pa.timestamp("ms"), "int": pa.int64(), "bool": pa.bool_()}
+    return pa.schema([(name, types[kind]) for name, kind in DATASETS[dataset]["columns"]])
+
+
+def write_parquet(batches, sink, dataset):
+    """Écrit les lots en Parquet (un groupe de lignes par lot) ; retourne le nombre de lignes.
+
+    `sink` : chemin ou flux binaire.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("L'export Parquet nécessite pyarrow (pip install pyarrow).")
+
+    schema = _arrow_schema(dataset)
+    rows = 0
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            rows += len(batch)
+    return rows
+
+
+def export(db, dataset, fmt, sink, date_from=None, date_to=None, practitioner=None, batch_size=EXPORT_BATCH_SIZE):
+    """Exporte un jeu de données filtré vers `sink` (chemin ou flux binaire).
+
+    Retourne le nombre de lignes écrites.
+    """
+    query = build_query(dataset, date_from, date_to, practitioner)
+    batches = iter_batches(db, dataset, query, batch_size)
+    if fmt == "parquet":
+        return write_parquet(batches, sink, dataset)
+    if fmt != "csv":
+        raise ValueError(f"Format inconnu : {fmt}")
+    if isinstance(sink, str):
+        with open(sink, "w", encoding="utf-8", newline="") as stream:
+            return write_csv(batches, stream, dataset)
+    stream = io.TextIOWrapper(sink, encoding="utf-8", newline="")
+    try:
+        return write_csv(batches, stream, dataset)
+    finally:
+        # Rend la main sur le flux binaire sans le fermer
+        stream.flush()
+        stream.detach()
+
+
+def purge_spool(spool_dir=EXPORT_SPOOL_DIR, ttl_minutes=EXPORT_SPOOL_TTL_MINUTES):
+    """Supprime les fichiers d'export plus vieux que `ttl_minutes` ; retourne leur nombre."""
+    cutoff = time.time() - ttl_minutes * 60
+    removed = 0
+    try:
+        entries = list(os.scandir(spool_dir))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass  # supprimé entre-temps par une autre session
+    return removed
+
+
+def spool_file(fmt, spool_dir=EXPORT_SPOOL_DIR):
+    """Chemin d'un nouveau fichier d'export dans le répertoire dédié (accès réservé au processus).
+
+    Les fichiers abandonnés depuis plus de EXPORT_SPOOL_TTL_MINUTES sont supprimés au passage.
+    """
+    os.makedirs(spool_dir, mode=0o700, exist_ok=True)
+    purge_spool(spool_dir)
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=FORMATS[fmt], dir=spool_dir)
+    os.close(fd)
+    return path
+
+
+def export_filename(dataset, fmt, today=None):
+    """Nom de fichier par défaut, ex. appointments_2024-03-12.parquet."""
+    today = today or datetime.date.today()
+    return f"{dataset}_{today:%Y-%m-%d}{FORMATS[fmt]}"
@@ -1,45 +1,127 @@
 import os
+import contextvars
 import datetime
 import hashlib
+import threading
+import time
+from collections import Counter
+from itertools import islice
 import pandas as pd
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, UpdateOne
 from bson.objectid import ObjectId
 import streamlit as st
 
+import migrations
+import log_archive
+import search_keys
+from appointment_status import status_fields
+from audit_log import AuditLogSink
+from autocomplete import PatientAutocomplete
+import query_monitor
+import scheduling
+from reference_cache import ReferenceCache
+
 # Configuration de la connexion MongoDB
 # Par défaut localhost, mais configurable via variable d'environnement
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-DB_NAME = "medigest_db"
+DB_NAME = os.getenv("MONGO_DB_NAME", "medigest_db")
+
+# Pool de connexions partagé par toutes les sessions du processus
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+}
+
+# Taille de page par défaut du journal d'audit
+LOGS_PAGE_SIZE = 50
+
+# Taille de page des listes de RDV par praticien
+APPOINTMENTS_PAGE_SIZE = 20
+
+# Taille de page de l'historique des visites d'un patient
+VISITS_PAGE_SIZE = 10
+
+# Nombre max. de patients renvoyés par une recherche par nom
+PATIENT_SEARCH_LIMIT = int(os.getenv("PATIENT_SEARCH_LIMIT", "100"))
+
+# Champs d'un résumé patient (listes, sélection du patient d'un RDV)
+PATIENT_SUMMARY_FIELDS = {"nom": 1, "prenom": 1, "telephone": 1}
+
+# Libellés des jours ($dayOfWeek : 1 = dimanche)
+DAY_NAMES = {1: "Dim", 2: "Lun", 3: "Mar", 4: "Mer", 5: "Jeu", 6: "Ven", 7: "Sam"}
+
 
+def _day_of_week(dt):
+    """Équivalent Python de $dayOfWeek (1 = dimanche, 7 = samedi)."""
+    return dt.isoweekday() % 7 + 1
+
+
+def _stats_keys(appt):
+    """Compteurs de la collection stats auxquels un RDV contribue."""
+    keys = [("total", None)]
+    if not appt["is_active"]:
+        keys.append(("cancelled", None))
+    else:
+        keys.append(("workload", appt["practitioner_id"]))
+        keys.append(("dow", _day_of_week(appt["date_heure_debut"])))
+    return keys
+
+
+def _stats_id(kind, key):
+    return kind if key is None else f"{kind}:{key}"
+
+
+def build_patient_doc(nom, prenom, phone, email, assurance, notes):
+    """Document patient normalisé (création unitaire et import en masse)."""
+    return {
+        "nom": nom.upper(),
+        "prenom": prenom.capitalize(),
+        "telephone": phone,
+        "email": email,
+        "assurance": assurance,
+        "notes_medicales": notes, # Peut être étendu dynamiquement
+        "search_keys": search_keys.patient_search_keys(nom, prenom),
+        "created_at": datetime.datetime.now()
+    }
+
+
+@query_monitor.instrument
 class DBManager:
-    def __init__(self):
+    def __init__(self, client=None, db_name=DB_NAME, auto_migrate=True):
         try:
-            self.client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-            self.db = self.client[DB_NAME]
+            self.client = client if client is not None else MongoClient(
+                MONGO_URI, event_listeners=query_monitor.listeners(), **MONGO_CLIENT_OPTIONS
+            )
+            self.db = self.client[db_name]
             # Vérification de la connexion
             self.client.server_info()
-            self._init_db()
+            self.audit = AuditLogSink(self.db.logs)
+            self.autocomplete = PatientAutocomplete()
+            self._autocomplete_lock = threading.Lock()
+            self.schedule = scheduling.schedule_store(self.db)
+            self.reference = ReferenceCache(self.db[migrations.META_COLLECTION])
+            if auto_migrate:
+                self._init_db()
         except Exception as e:
             st.error(f"Erreur de connexion à MongoDB : {e}")
             self.db = None
 
     def _init_db(self):
-        """Initialise les index et crée un administrateur par défaut si aucun utilisateur n'existe."""
-        if self.db is None: return
+        """Applique les étapes de schéma manquantes (index, admin par défaut...).
 
-        # Création des index pour la performance
-        self.db.patients.create_index([("nom", ASCENDING), ("prenom", ASCENDING)])
-        self.db.appointments.create_index([("date_heure_debut", ASCENDING)])
-        self.db.appointments.create_index([("practitioner_name", ASCENDING), ("date_heure_debut", ASCENDING)])
-        self.db.logs.create_index([("timestamp", DESCENDING)])
-        try:
-            self.db.users.create_index("username", unique=True)
-        except Exception:
-            pass  # Index may already exist or duplicates prevent creation
-        
-        # Création d'un admin par défaut si la collection users est vide
-        if self.db.users.count_documents({}) == 0:
-            self.create_user("admin", "admin123", "Administrateur", "admin")
+        Si la base est déjà à jour, seules la version du schéma et la variante du
+        registre de créneaux sont lues.
+        """
+        if self.db is None: return
+        migrations.apply_migrations(self)
+        # Variante de registre de créneaux changée (SCHEDULE_BACKEND) : reconstruction
+        built = self.db[migrations.META_COLLECTION].find_one({"_id": "schedule"}, {"backend": 1})
+        if built is None or built.get("backend") != self.schedule.name:
+            self.rebuild_schedule()
 
     # --- Authentification & Utilisateurs ---
 
@@ -67,95 +149,221 @@ class DBManager:
                 "created_at": datetime.datetime.now()
             }
             self.db.users.insert_one(user_data)
+            self.reference.invalidate("users")
             self.log_action(created_by, "CREATE_USER", f"Utilisateur {username} créé")
             return True, f"Utilisateur {username} créé avec succès."
         except Exception as e:
             return False, str(e)
 
     def get_all_users(self):
-        return list(self.db.users.find({}, {"password": 0})) # Exclure le mot de passe
+        """Liste des utilisateurs (sans mot de passe), servie par le cache de référence."""
+        return self.reference.get("users", lambda: list(self.db.users.find({}, {"password": 0})))
 
     # --- Journalisation (Logs) ---
 
-    def log_action(self, user, action, details):
-        """Enregistre une action dans la collection logs."""
+    def log_action(self, user, action, details, durable=False):
+        """Enregistre une action dans la collection logs.
+
+        L'écriture est différée (voir audit_log.py), sauf si `durable` est vrai ou si
+        l'action fait partie de AUDIT_LOG_DURABLE_ACTIONS.
+        """
         log_entry = {
             "user": user,
             "action": action,
             "details": details,
             "timestamp": datetime.datetime.now()
         }
-        self.db.logs.insert_one(log_entry)
+        self.audit.write(log_entry, durable=durable)
 
     def get_logs(self):
         """Récupère tous les logs triés par date décroissante."""
+        self.audit.flush()
         return list(self.db.logs.find().sort("timestamp", DESCENDING))
 
+    def get_logs_page(self, page_size=LOGS_PAGE_SIZE, after=None, user=None, action=None, date_from=None, date_to=None):
+        """Récupère une page de logs (plus récents d'abord), filtrée côté serveur.
+
+        Pagination par clé sur (timestamp, _id) : `after` est le curseur renvoyé par
+        l'appel précédent. Retourne (logs, curseur_suivant), curseur à None en fin de liste.
+        Si `date_from` est antérieure à la fenêtre chaude, la suite de la liste est lue
+        dans les segments archivés (voir log_archive.py).
+        """
+        query = {}
+        if user:
+            query["user"] = user
+        if action:
+            query["action"] = action
+        ts_range = {}
+        if date_from:
+            ts_range["$gte"] = date_from
+        if date_to:
+            ts_range["$lte"] = date_to
+        if ts_range:
+            query["timestamp"] = ts_range
+        if after:
+            after_ts, after_id = after
+            query["$or"] = [
+                {"timestamp": {"$lt": after_ts}},
+                {"timestamp": after_ts, "_id": {"$lt": after_id}}
+            ]
+
+        self.audit.flush()
+        # Un document de plus que la page pour savoir s'il existe une page suivante
+        logs = list(self.db.logs.find(query)
+                    .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+                    .limit(page_size + 1))
+        if len(logs) <= page_size and date_from and date_from < log_archive.hot_cutoff():
+            archive_after = (logs[-1]["timestamp"], logs[-1]["_id"]) if logs else after
+            archived = log_archive.iter_archived_logs(
+                date_from, date_to, after=archive_after, user=user, action=action
+            )
+            logs += list(islice(archived, page_size + 1 - len(logs)))
+        next_cursor = None
+        if len(logs) > page_size:
+            logs = logs[:page_size]
+            next_cursor = (logs[-1]["timestamp"], logs[-1]["_id"])
+        return logs, next_cursor
+
+    def get_log_filter_values(self):
+        """Utilisateurs et types d'action présents dans les logs (pour les filtres)."""
+        return sorted(self.db.logs.distinct("user")), sorted(self.db.logs.distinct("action"))
+
     # --- Gestion des Patients ---
 
     def create_patient(self, nom, prenom, phone, email, assurance, notes, created_by):
         """Crée un nouveau dossier patient."""
         try:
-            patient = {
-                "nom": nom.upper(),
-                "prenom": prenom.capitalize(),
-                "telephone": phone,
-                "email": email,
-                "assurance": assurance,
-                "notes_medicales": notes, # Peut être étendu dynamiquement
-                "historique_visites": [],
-                "created_at": datetime.datetime.now()
-            }
+            patient = build_patient_doc(nom, prenom, phone, email, assurance, notes)
             res = self.db.patients.insert_one(patient)
+            self.autocomplete.upsert(res.inserted_id, patient["nom"], patient["prenom"], phone)
             self.log_action(created_by, "CREATE_PATIENT", f"Patient {nom} {prenom} créé (ID: {res.inserted_id})")
             return True, f"Patient ajouté avec succès."
         except Exception as e:
             return False, str(e)
 
-    def search_patients(self, query):
-        """Recherche globale (Nom, Prénom ou ID)."""
+    def _patient_search_filter(self, query):
+        """Filtre d'une recherche par ID ou par préfixes de nom/prénom (None si rien à chercher)."""
         if not query:
-            return []
-        
+            return None
         # Recherche par ObjectId si la requête ressemble à un ID
         if ObjectId.is_valid(query):
-            return list(self.db.patients.find({"_id": ObjectId(query)}))
-        
-        # Recherche textuelle (regex insensible à la casse)
-        regex_query = {"$regex": query, "$options": "i"}
-        return list(self.db.patients.find({
-            "$or": [
-                {"nom": regex_query},
-                {"prenom": regex_query}
-            ]
-        }))
+            return {"_id": ObjectId(query)}
+        return search_keys.prefix_query(query)
+
+    def search_patients(self, query, limit=PATIENT_SEARCH_LIMIT):
+        """Recherche globale (Nom, Prénom ou ID), dossiers complets.
+
+        Chaque mot saisi est comparé en préfixe, sans accents ni casse, aux clés
+        `search_keys` (intervalle sur index) : « dup jea » trouve « DUPONT Jean ».
+        """
+        patient_filter = self._patient_search_filter(query)
+        if patient_filter is None:
+            return []
+        return list(self.db.patients.find(patient_filter).limit(limit))
+
+    def search_patient_summaries(self, query, limit=PATIENT_SEARCH_LIMIT):
+        """Même recherche que `search_patients`, limitée aux champs PATIENT_SUMMARY_FIELDS.
+
+        Ni notes médicales ni clés de recherche : de quoi lister et choisir un patient.
+        """
+        patient_filter = self._patient_search_filter(query)
+        if patient_filter is None:
+            return []
+        return list(self.db.patients.find(patient_filter, PATIENT_SUMMARY_FIELDS).limit(limit))
+
+    def get_patient(self, patient_id):
+        """Dossier complet d'un patient (None s'il n'existe pas)."""
+        return self.db.patients.find_one({"_id": ObjectId(patient_id)})
+
+    def autocomplete_patients(self, text, k=8):
+        """Suggestions [(patient_id, libellé)] servies par l'index mémoire partagé, sans requête.
+
+        L'index est chargé en une passe au premier appel (seul chargement bloquant), puis
+        rechargé toutes les AUTOCOMPLETE_REFRESH_SECONDS par un thread de fond pour
+        intégrer les écritures des autres processus ; l'ancien index sert entre-temps.
+        """
+        if self.autocomplete.loaded_at is None:
+            with self._autocomplete_lock:
+                if self.autocomplete.loaded_at is None:
+                    self._load_autocomplete()
+        elif self.autocomplete.is_stale() and self._autocomplete_lock.acquire(blocking=False):
+            # Un seul rechargement à la fois ; les autres appels ne l'attendent pas
+            # Contexte copié : les requêtes du rechargement restent attribuées à autocomplete_patients
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._reload_autocomplete,),
+                             name="autocomplete-reload", daemon=True).start()
+        return self.autocomplete.lookup(text, k)
+
+    def _load_autocomplete(self):
+        self.autocomplete.load(
+            self.db.patients.find({}, {"nom": 1, "prenom": 1, "telephone": 1}).batch_size(5000)
+        )
+
+    def _reload_autocomplete(self):
+        """Corps du thread de rechargement ; libère le verrou pris par l'appelant."""
+        try:
+            self._load_autocomplete()
+        except Exception:
+            # L'ancien index reste en service ; nouvelle tentative à la période suivante
+            self.autocomplete.loaded_at = time.monotonic()
+        finally:
+            self._autocomplete_lock.release()
 
     def update_patient(self, patient_id, updated_data, updated_by):
         """Met à jour les informations d'un patient."""
         try:
+            updated_data = dict(updated_data)
+            if "nom" in updated_data or "prenom" in updated_data:
+                # Recalcul des clés de recherche (le champ absent est relu en base)
+                names = {k: updated_data[k] for k in ("nom", "prenom") if k in updated_data}
+                if len(names) < 2:
+                    current = self.db.patients.find_one({"_id": ObjectId(patient_id)}, {"nom": 1, "prenom": 1}) or {}
+                    names = {"nom": current.get("nom", ""), "prenom": current.get("prenom", ""), **names}
+                updated_data["search_keys"] = search_keys.patient_search_keys(names["nom"], names["prenom"])
             self.db.patients.update_one(
                 {"_id": ObjectId(patient_id)},
                 {"$set": updated_data}
             )
+            if {"nom", "prenom", "telephone"} & updated_data.keys():
+                pat = self.db.patients.find_one({"_id": ObjectId(patient_id)}, {"nom": 1, "prenom": 1, "telephone": 1})
+                if pat:
+                    self.autocomplete.upsert(pat["_id"], pat.get("nom", ""), pat.get("prenom", ""), pat.get("telephone", ""))
             self.log_action(updated_by, "UPDATE_PATIENT", f"Patient {patient_id} mis à jour")
             return True, "Informations patient mises à jour."
         except Exception as e:
             return False, str(e)
 
+    def get_patient_visits(self, patient_id, skip=0, limit=VISITS_PAGE_SIZE):
+        """Une page de l'historique des visites d'un patient, plus récentes d'abord.
+
+        Retourne (visites, il_reste_des_visites).
+        """
+        cursor = (
+            self.db.visits.find({"patient_id": ObjectId(patient_id)}, {"_id": 0, "date": 1, "practitioner": 1, "motif": 1})
+            .sort("date", DESCENDING)
+            .skip(skip)
+            .limit(limit + 1)
+        )
+        visits = list(cursor)
+        return visits[:limit], len(visits) > limit
+
     # --- Gestion des Praticiens ---
     
     def get_practitioners(self):
-        """Récupère la liste des praticiens."""
+        """Récupère la liste des praticiens (cache de référence partagé entre sessions)."""
+        return self.reference.get("practitioners", self._load_practitioners)
+
+    def _load_practitioners(self):
+        practitioners = list(self.db.practitioners.find())
         # Pour simplifier l'exemple, si la liste est vide, on en crée par défaut
-        if self.db.practitioners.count_documents({}) == 0:
-            defaults = [
+        if not practitioners:
+            practitioners = [
                 {"nom": "Dr. Dupont", "specialite": "Généraliste"},
                 {"nom": "Dr. Martin", "specialite": "Cardiologue"},
                 {"nom": "Dr. Leroy", "specialite": "Pédiatre"}
             ]
-            self.db.practitioners.insert_many(defaults)
-        
-        return list(self.db.practitioners.find())
+            self.db.practitioners.insert_many(practitioners)
+        return practitioners
 
     def create_practitioner(self, nom, specialite, created_by):
         """Ajoute un nouveau praticien."""
@@ -166,18 +374,34 @@ class DBManager:
                 "created_at": datetime.datetime.now()
             }
             self.db.practitioners.insert_one(practitioner)
+            self.reference.invalidate("practitioners")
             self.log_action(created_by, "CREATE_PRACTITIONER", f"Praticien {nom} ajouté")
             return True, "Praticien ajouté avec succès."
         except Exception as e:
             return False, str(e)
 
     def update_practitioner(self, practitioner_id, updated_data, updated_by):
-        """Met à jour les informations d'un praticien."""
+        """Met à jour les informations d'un praticien.
+
+        Les RDV et visites le référencent par `practitioner_id` : un changement de nom
+        ne fait que recopier le libellé dénormalisé (un `update_many` par collection).
+        """
         try:
+            practitioner_id = ObjectId(practitioner_id)
             self.db.practitioners.update_one(
-                {"_id": ObjectId(practitioner_id)},
+                {"_id": practitioner_id},
                 {"$set": updated_data}
             )
+            if "nom" in updated_data:
+                self.db.appointments.update_many(
+                    {"practitioner_id": practitioner_id},
+                    {"$set": {"practitioner_name": updated_data["nom"]}}
+                )
+                self.db.visits.update_many(
+                    {"practitioner_id": practitioner_id},
+                    {"$set": {"practitioner": updated_data["nom"]}}
+                )
+            self.reference.invalidate("practitioners")
             self.log_action(updated_by, "UPDATE_PRACTITIONER", f"Praticien {practitioner_id} mis à jour")
             return True, "Informations praticien mises à jour."
         except Exception as e:
@@ -192,15 +416,16 @@ class DBManager:
 
             # Vérifier s'il a des rendez-vous futurs non annulés
             future_appts = self.db.appointments.count_documents({
-                "practitioner_name": prac["nom"],
+                "practitioner_id": prac["_id"],
                 "date_heure_debut": {"$gte": datetime.datetime.now()},
-                "statut": {"$not": {"$regex": "^Annulé"}}
+                "is_active": True
             })
             if future_appts > 0:
                 return False, f"Impossible : {future_appts} rendez-vous futur(s) existent pour ce praticien."
 
             res = self.db.practitioners.delete_one({"_id": ObjectId(practitioner_id)})
             if res.deleted_count > 0:
+                self.reference.invalidate("practitioners")
                 self.log_action(deleted_by, "DELETE_PRACTITIONER", f"Praticien {prac['nom']} supprimé")
                 return True, "Praticien supprimé."
             return False, "Erreur lors de la suppression."
@@ -209,12 +434,22 @@ class DBManager:
 
     # --- Gestion des Rendez-vous ---
 
-    def check_appointment_overlap(self, practitioner_name, start_time, end_time, exclude_appt_id=None):
+    def _practitioner(self, practitioner_id):
+        """Praticien d'identifiant `practitioner_id`, ou None.
+
+        Lu dans le cache de référence, sinon en base (praticien créé par un autre
+        processus depuis la dernière vérification du cache).
+        """
+        practitioner_id = ObjectId(practitioner_id)
+        cached = next((p for p in self.get_practitioners() if p["_id"] == practitioner_id), None)
+        return cached or self.db.practitioners.find_one({"_id": practitioner_id})
+
+    def check_appointment_overlap(self, practitioner_id, start_time, end_time, exclude_appt_id=None):
         """Vérifie si un créneau est déjà pris pour un praticien."""
         # Un RDV chevauche si : (StartA < EndB) et (EndA > StartB)
         query = {
-            "practitioner_name": practitioner_name,
-            "statut": {"$not": {"$regex": "^Annulé"}},  # Ignore tous les statuts commençant par "Annulé"
+            "practitioner_id": ObjectId(practitioner_id),
+            "is_active": True,  # Ignore tous les statuts commençant par "Annulé"
             "$and": [
                 {"date_heure_debut": {"$lt": end_time}},
                 {"date_heure_fin": {"$gt": start_time}}
@@ -228,44 +463,206 @@ class DBManager:
         count = self.db.appointments.count_documents(query)
         return count > 0
 
-    def create_appointment(self, patient_id, practitioner_name, start_time, duration_minutes, motif, created_by):
-        """Crée un rendez-vous avec validation de chevauchement."""
+    def find_free_slots(self, date_from, date_to, duration_minutes, practitioners=None, specialty=None, limit=None):
+        """Créneaux libres de `duration_minutes` entre date_from et date_to (dates incluses).
+
+        `practitioners` : liste d'identifiants, restreinte aux praticiens de `specialty` si
+        fournie (identifiants inconnus ignorés) ; sinon tous les praticiens de `specialty`.
+        Les intervalles occupés sont lus en une requête sur le registre de créneaux,
+        puis balayés par praticien (scheduling.free_gaps).
+        Retourne [{"practitioner_id", "practitioner", "start", "end"}] triés par début
+        (`practitioner` : nom affiché).
+        """
+        names = {p["_id"]: p["nom"] for p in self.get_practitioners()
+                 if not specialty or p.get("specialite") == specialty}
+        if practitioners is None:
+            practitioners = list(names)
+        else:
+            practitioners = [ObjectId(p) for p in dict.fromkeys(practitioners)
+                             if ObjectId.is_valid(p) and ObjectId(p) in names]
+        if not practitioners:
+            return []
+
+        windows = scheduling.opening_windows(date_from, date_to)
+        if not windows:
+            return []
+        busy = self.schedule.busy_intervals(practitioners, windows[0][0], windows[-1][1])
+
+        duration = datetime.timedelta(minutes=duration_minutes)
+        now = datetime.datetime.now()
+        slots = []
+        for practitioner_id, intervals in busy.items():
+            name = names[practitioner_id]
+            for gap_start, gap_end in scheduling.free_gaps(intervals, windows):
+                for start in scheduling.slot_starts(gap_start, gap_end, duration, not_before=now):
+                    slots.append({"practitioner_id": practitioner_id, "practitioner": name,
+                                  "start": start, "end": start + duration})
+        slots.sort(key=lambda slot: (slot["start"], slot["practitioner"]))
+        return slots[:limit] if limit else slots
+
+    def create_appointment(self, patient_id, practitioner_id, start_time, duration_minutes, motif, created_by):
+        """Crée un rendez-vous après réservation atomique du créneau (voir scheduling.py)."""
         # Vérifier que le RDV n'est pas dans le passé
         if start_time < datetime.datetime.now():
             return False, "Impossible de créer un rendez-vous dans le passé."
 
+        practitioner = self._practitioner(practitioner_id)
+        if practitioner is None:
+            return False, "Praticien introuvable."
+        practitioner_id, practitioner_name = practitioner["_id"], practitioner["nom"]
+        if not ObjectId.is_valid(patient_id):
+            return False, "Identifiant patient invalide."
+        patient_id = ObjectId(patient_id)
         end_time = start_time + datetime.timedelta(minutes=duration_minutes)
 
-        if self.check_appointment_overlap(practitioner_name, start_time, end_time):
-            return False, "Le praticien n'est pas disponible sur ce créneau."
+        # Document construit avant la réservation : rien ne peut échouer entre les deux
+        # hormis l'insertion. L'identifiant est fixé pour être inscrit dans la réservation.
+        appt_id = ObjectId()
+        appt = {
+            "_id": appt_id,
+            "patient_id": patient_id,
+            "practitioner_id": practitioner_id,
+            "practitioner_name": practitioner_name,
+            "date_heure_debut": start_time,
+            "date_heure_fin": end_time,
+            "duree_minutes": duration_minutes,
+            "motif": motif,
+            **status_fields("Confirmé"),
+            "created_at": datetime.datetime.now()
+        }
+        try:
+            if not self.schedule.reserve(practitioner_id, start_time, end_time, appt_id):
+                return False, "Le praticien n'est pas disponible sur ce créneau."
+        except Exception as e:
+            return False, str(e)
+
+        try:
+            try:
+                self.db.appointments.insert_one(appt)
+            except BaseException:
+                # Aucun RDV écrit : le créneau réservé ne doit pas rester bloqué
+                self.schedule.release(practitioner_id, start_time, end_time, appt_id)
+                raise
+            self._update_stats(after=appt)
+            
+            # Historique du patient : collection séparée, le dossier patient ne grossit pas
+            self.db.visits.insert_one({
+                "patient_id": patient_id,
+                "appointment_id": appt_id,
+                "date": start_time,
+                "practitioner_id": practitioner_id,
+                "practitioner": practitioner_name,
+                "motif": motif
+            })
+            
+            self.log_action(created_by, "CREATE_APPT", f"RDV créé pour patient {patient_id} avec {practitioner_name}")
+            return True, "Rendez-vous confirmé."
+        except Exception as e:
+            return False, str(e)
+
+    def create_appointment_series(self, patient_id, practitioner_id, first_start, duration_minutes, motif, created_by,
+                                  interval_weeks=1, until=None, count=None):
+        """Crée une série de RDV toutes les `interval_weeks` semaines, jusqu'au jour `until` et/ou `count` fois.
+
+        Toutes les occurrences sont confrontées aux créneaux occupés du praticien en une
+        seule lecture du registre (balayage en mémoire, scheduling.overlapping) ; les
+        occurrences libres sont réservées puis insérées par `insert_many`.
+        Retourne (succès, message, débuts des occurrences en conflit).
+        """
+        if first_start < datetime.datetime.now():
+            return False, "Impossible de créer un rendez-vous dans le passé.", []
+        practitioner = self._practitioner(practitioner_id)
+        if practitioner is None:
+            return False, "Praticien introuvable.", []
+        practitioner_id, practitioner_name = practitioner["_id"], practitioner["nom"]
+        if not ObjectId.is_valid(patient_id):
+            return False, "Identifiant patient invalide.", []
+        patient_id = ObjectId(patient_id)
+        try:
+            starts = scheduling.weekly_occurrences(first_start, interval_weeks, until, count)
+        except ValueError as e:
+            return False, str(e), []
 
+        duration = datetime.timedelta(minutes=duration_minutes)
+        occurrences = [(start, start + duration) for start in starts]
+        reserved = []
         try:
-            appt = {
-                "patient_id": ObjectId(patient_id),
+            busy = self.schedule.busy_intervals([practitioner_id], occurrences[0][0], occurrences[-1][1])[practitioner_id]
+            conflicting = set(scheduling.overlapping(occurrences, busy))
+
+            # Réservation atomique de chaque occurrence libre : un créneau pris entre-temps
+            # par une autre session est compté comme conflit
+            for index, (start, end) in enumerate(occurrences):
+                if index in conflicting:
+                    continue
+                appt_id = ObjectId()
+                if self.schedule.reserve(practitioner_id, start, end, appt_id):
+                    reserved.append((appt_id, start, end))
+                else:
+                    conflicting.add(index)
+        except Exception as e:
+            # Aucun RDV n'est créé : les créneaux déjà réservés ne doivent pas rester bloqués
+            self._release_series(practitioner_id, reserved)
+            return False, str(e), []
+        conflicts = [occurrences[index][0] for index in sorted(conflicting)]
+        if not reserved:
+            return False, "Aucune occurrence disponible : tous les créneaux sont pris.", conflicts
+
+        series_id = ObjectId()
+        now = datetime.datetime.now()
+        appts = [
+            {
+                "_id": appt_id,
+                "patient_id": patient_id,
+                "practitioner_id": practitioner_id,
                 "practitioner_name": practitioner_name,
-                "date_heure_debut": start_time,
-                "date_heure_fin": end_time,
+                "date_heure_debut": start,
+                "date_heure_fin": end,
                 "duree_minutes": duration_minutes,
                 "motif": motif,
-                "statut": "Confirmé",
-                "created_at": datetime.datetime.now()
+                "series_id": series_id,
+                **status_fields("Confirmé"),
+                "created_at": now
             }
-            self.db.appointments.insert_one(appt)
-            
-            # Mise à jour de l'historique du patient
-            self.db.patients.update_one(
-                {"_id": ObjectId(patient_id)},
-                {"$push": {"historique_visites": {
-                    "date": start_time,
+            for appt_id, start, end in reserved
+        ]
+        try:
+            try:
+                self.db.appointments.insert_many(appts)
+            except Exception:
+                # insert_many ordonné : une partie des RDV a pu être écrite avant l'erreur
+                self.db.appointments.delete_many({"series_id": series_id})
+                self._release_series(practitioner_id, reserved)
+                raise
+            self._update_stats(created=appts)
+            self.db.visits.insert_many([
+                {
+                    "patient_id": appt["patient_id"],
+                    "appointment_id": appt["_id"],
+                    "date": appt["date_heure_debut"],
+                    "practitioner_id": practitioner_id,
                     "practitioner": practitioner_name,
                     "motif": motif
-                }}}
+                }
+                for appt in appts
+            ])
+            self.log_action(
+                created_by, "CREATE_APPT_SERIES",
+                f"Série de {len(appts)} RDV créée pour patient {patient_id} avec {practitioner_name} "
+                f"(toutes les {interval_weeks} semaine(s), {len(conflicts)} conflit(s))"
             )
-            
-            self.log_action(created_by, "CREATE_APPT", f"RDV créé pour patient {patient_id} avec {practitioner_name}")
-            return True, "Rendez-vous confirmé."
+            return True, f"{len(appts)} rendez-vous confirmés sur {len(occurrences)}.", conflicts
         except Exception as e:
-            return False, str(e)
+            return False, str(e), conflicts
+
+    def _release_series(self, practitioner_id, reserved):
+        """Libère les réservations (appt_id, début, fin) d'une série non créée."""
+        for appt_id, start, end in reserved:
+            try:
+                self.schedule.release(practitioner_id, start, end, appt_id)
+            except Exception:
+                # Créneau resté bloqué : rebuild_schedule le libérera
+                continue
 
     def reschedule_appointment(self, appt_id, new_start_time, new_duration, user):
         """Déplace un rendez-vous (changement date/heure/durée)."""
@@ -285,18 +682,52 @@ class DBManager:
 
             new_end_time = new_start_time + datetime.timedelta(minutes=new_duration)
             
-            # Vérifier chevauchement en excluant le RDV actuel
-            if self.check_appointment_overlap(current_appt["practitioner_name"], new_start_time, new_end_time, exclude_appt_id=appt_id):
+            pending = None
+            if current_appt["is_active"]:
+                # Le nouveau créneau est réservé (en ignorant l'ancien) ; l'ancien n'est
+                # libéré qu'après l'écriture du RDV (commit_move)
+                pending = self.schedule.begin_move(
+                    current_appt["practitioner_id"],
+                    current_appt["date_heure_debut"], current_appt["date_heure_fin"],
+                    new_start_time, new_end_time, current_appt["_id"]
+                )
+                if pending is None:
+                    return False, "Ce créneau est déjà pris."
+            elif self.check_appointment_overlap(current_appt["practitioner_id"], new_start_time, new_end_time, exclude_appt_id=appt_id):
+                # RDV annulé : il n'occupe aucun créneau, simple vérification
                 return False, "Ce créneau est déjà pris."
 
-            self.db.appointments.update_one(
-                {"_id": ObjectId(appt_id)},
-                {"$set": {
-                    "date_heure_debut": new_start_time,
-                    "date_heure_fin": new_end_time,
-                    "duree_minutes": new_duration
-                }}
-            )
+            changes = {
+                "date_heure_debut": new_start_time,
+                "date_heure_fin": new_end_time,
+                "duree_minutes": new_duration
+            }
+            # Mise à jour conditionnée à l'état lu plus haut ; les compteurs partent du
+            # document renvoyé par la même opération atomique, pas de la lecture initiale
+            try:
+                before = self.db.appointments.find_one_and_update(
+                    {
+                        "_id": current_appt["_id"],
+                        "is_active": current_appt["is_active"],
+                        "date_heure_debut": current_appt["date_heure_debut"],
+                        "date_heure_fin": current_appt["date_heure_fin"]
+                    },
+                    {"$set": changes},
+                    return_document=ReturnDocument.BEFORE
+                )
+            except Exception:
+                if pending is not None:
+                    self.schedule.abort_move(pending)
+                raise
+            if before is None:
+                # Statut ou horaire modifié entre-temps par une autre session (qui gère
+                # l'ancien créneau) : seul le nouveau créneau réservé plus haut est rendu
+                if pending is not None:
+                    self.schedule.abort_move(pending)
+                return False, "Le rendez-vous a été modifié entre-temps : veuillez réessayer."
+            if pending is not None:
+                self.schedule.commit_move(pending)
+            self._update_stats(before=before, after={**before, **changes})
             self.log_action(user, "RESCHEDULE_APPT", f"RDV {appt_id} déplacé au {new_start_time}")
             return True, "Rendez-vous modifié avec succès."
         except Exception as e:
@@ -305,8 +736,12 @@ class DBManager:
     def delete_appointment(self, appt_id, user):
         """Supprime définitivement un rendez-vous."""
         try:
-            res = self.db.appointments.delete_one({"_id": ObjectId(appt_id)})
-            if res.deleted_count > 0:
+            deleted = self.db.appointments.find_one_and_delete({"_id": ObjectId(appt_id)})
+            if deleted:
+                if deleted["is_active"]:
+                    self.schedule.release(deleted["practitioner_id"], deleted["date_heure_debut"],
+                                          deleted["date_heure_fin"], deleted["_id"])
+                self._update_stats(before=deleted)
                 self.log_action(user, "DELETE_APPT", f"RDV {appt_id} supprimé définitivement")
                 return True, "Rendez-vous supprimé."
             return False, "Erreur suppression."
@@ -321,76 +756,242 @@ class DBManager:
             end_of_day = datetime.datetime.combine(date_filter, datetime.time.max)
             query["date_heure_debut"] = {"$gte": start_of_day, "$lte": end_of_day}
         
-        # On fait un lookup (join) pour avoir le nom du patient directement si besoin,
-        # mais pour simplifier ici on récupère juste les objets
         appts = list(self.db.appointments.find(query).sort("date_heure_debut", ASCENDING))
-        
-        # Enrichissement manuel des données patient pour l'affichage
+        self._attach_patient_names(appts)
+        return appts
+
+    def count_appointments_by_practitioner(self, start, end):
+        """Nombre de RDV par identifiant de praticien sur [start, end[, en une seule agrégation."""
+        pipeline = [
+            {"$match": {"date_heure_debut": {"$gte": start, "$lt": end}}},
+            {"$group": {"_id": "$practitioner_id", "count": {"$sum": 1}}}
+        ]
+        return {row["_id"]: row["count"] for row in self.db.appointments.aggregate(pipeline)}
+
+    def get_practitioner_appointments(self, practitioner_id, start, end, skip=0, limit=APPOINTMENTS_PAGE_SIZE):
+        """Une page des RDV d'un praticien sur [start, end[, triés par heure de début."""
+        query = {
+            "practitioner_id": ObjectId(practitioner_id),
+            # Égalité sur les deux valeurs : l'index (practitioner_id, is_active, date_heure_debut, ...)
+            # fournit alors le tri par fusion, sans tri en mémoire
+            "is_active": {"$in": [True, False]},
+            "date_heure_debut": {"$gte": start, "$lt": end}
+        }
+        appts = list(
+            self.db.appointments.find(query)
+            .sort("date_heure_debut", ASCENDING)
+            .skip(skip)
+            .limit(limit)
+        )
+        self._attach_patient_names(appts)
+        return appts
+
+    def _attach_patient_names(self, appts):
+        """Ajoute `patient_nom` aux RDV avec une seule requête `$in` sur les patients."""
+        if not appts:
+            return appts
+
+        patient_ids = list({appt["patient_id"] for appt in appts})
+        names = {
+            pat["_id"]: f"{pat['nom']} {pat['prenom']}"
+            for pat in self.db.patients.find({"_id": {"$in": patient_ids}}, {"nom": 1, "prenom": 1})
+        }
         for appt in appts:
-            pat = self.db.patients.find_one({"_id": appt["patient_id"]})
-            if pat:
-                appt["patient_nom"] = f"{pat['nom']} {pat['prenom']}"
-            else:
-                appt["patient_nom"] = "Inconnu"
+            appt["patient_nom"] = names.get(appt["patient_id"], "Inconnu")
         return appts
 
     def update_appointment_status(self, appt_id, new_status, updated_by):
-        """Modifie le statut d'un RDV (Annulé, Absent, etc.)."""
+        """Modifie le statut d'un RDV (Annulé, Absent, etc.).
+
+        Réactiver un RDV annulé réserve à nouveau son créneau : False s'il a été pris entre-temps.
+        """
         try:
-            self.db.appointments.update_one(
+            fields = status_fields(new_status)
+            current = self.db.appointments.find_one(
                 {"_id": ObjectId(appt_id)},
-                {"$set": {"statut": new_status}}
+                {"practitioner_id": 1, "date_heure_debut": 1, "date_heure_fin": 1, "is_active": 1}
             )
+            reactivated = current is not None and fields["is_active"] and not current["is_active"]
+            if reactivated and not self.schedule.reserve(current["practitioner_id"], current["date_heure_debut"],
+                                                         current["date_heure_fin"], current["_id"]):
+                return False
+
+            # Conditionné à l'état actif lu plus haut : une annulation / réactivation
+            # concurrente ferait diverger registre et compteurs
+            query = {"_id": ObjectId(appt_id)}
+            if current is not None:
+                query["is_active"] = current["is_active"]
+            before = self.db.appointments.find_one_and_update(
+                query,
+                {"$set": fields},
+                return_document=ReturnDocument.BEFORE
+            )
+            if before is None and current is not None:
+                if reactivated:
+                    self.schedule.release(current["practitioner_id"], current["date_heure_debut"],
+                                          current["date_heure_fin"], current["_id"])
+                return False
+            if before:
+                if before["is_active"] and not fields["is_active"]:
+                    self.schedule.release(before["practitioner_id"], before["date_heure_debut"],
+                                          before["date_heure_fin"], before["_id"])
+                self._update_stats(before=before, after={**before, **fields})
             self.log_action(updated_by, "UPDATE_APPT", f"RDV {appt_id} passé à {new_status}")
             return True
         except Exception as e:
             return False
 
+    def rebuild_schedule(self):
+        """Reconstruit le registre de créneaux (SCHEDULE_BACKEND) à venir à partir des RDV actifs.
+
+        Les RDV sans `practitioner_id` (base pas encore passée par la migration 11) sont
+        ignorés : l'étape 11 reconstruit le registre une fois les identifiants renseignés.
+        """
+        since = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        active = self.db.appointments.find(
+            {"is_active": True, "date_heure_fin": {"$gt": since}, "practitioner_id": {"$exists": True}},
+            {"practitioner_id": 1, "date_heure_debut": 1, "date_heure_fin": 1}
+        )
+        count = self.schedule.rebuild(active, since)
+        self.db[migrations.META_COLLECTION].update_one(
+            {"_id": "schedule"},
+            {"$set": {"backend": self.schedule.name, "rebuilt_at": datetime.datetime.now()}},
+            upsert=True
+        )
+        return count
+
     # --- Statistiques ---
+    # Les KPIs sur les RDV sont lus dans la collection `stats`, tenue à jour par `$inc`
+    # à chaque écriture (création, statut, déplacement, suppression). `rebuild_stats`
+    # la recalcule à partir de `appointments` en cas de dérive.
+
+    def _update_stats(self, before=None, after=None, created=()):
+        """Applique aux compteurs la différence entre l'ancien et le nouvel état d'un RDV.
+
+        `before` doit être le document renvoyé par l'écriture elle-même
+        (find_one_and_update / find_one_and_delete, état avant) : une lecture séparée
+        laisserait dériver les compteurs si une autre session modifie le RDV entre-temps.
+        `created` : RDV insérés en lot (série), comptés dans la même écriture groupée.
+        """
+        deltas = Counter()
+        if before:
+            for key in _stats_keys(before):
+                deltas[key] -= 1
+        for appt in ([after] if after else []) + list(created):
+            for key in _stats_keys(appt):
+                deltas[key] += 1
+        ops = [
+            UpdateOne(
+                {"_id": _stats_id(kind, key)},
+                {"$inc": {"count": delta}, "$setOnInsert": {"kind": kind, "key": key}},
+                upsert=True
+            )
+            for (kind, key), delta in deltas.items() if delta
+        ]
+        if ops:
+            self.db.stats.bulk_write(ops, ordered=False)
+
+    def rebuild_stats(self):
+        """Recalcule la collection stats à partir de appointments (réparation de dérive)."""
+        appt_stats = self._appointment_stats()
+        totals = appt_stats["totals"][0] if appt_stats["totals"] else {"total": 0, "cancelled": 0}
+        docs = [
+            {"_id": "total", "kind": "total", "key": None, "count": totals["total"]},
+            {"_id": "cancelled", "kind": "cancelled", "key": None, "count": totals["cancelled"]}
+        ]
+        docs += [{"_id": _stats_id("workload", w["_id"]), "kind": "workload", "key": w["_id"], "count": w["count"]}
+                 for w in appt_stats["workload"]]
+        docs += [{"_id": _stats_id("dow", d["_id"]), "kind": "dow", "key": d["_id"], "count": d["count"]}
+                 for d in appt_stats["by_day"]]
+
+        self.db.stats.delete_many({"_id": {"$nin": [doc["_id"] for doc in docs]}})
+        self.db.stats.bulk_write([UpdateOne({"_id": doc["_id"]}, {"$set": doc}, upsert=True) for doc in docs])
+        return len(docs)
+
+    def _read_stats(self):
+        """Lit tous les compteurs (collection de quelques dizaines de documents).
+
+        La charge de travail, comptée par identifiant de praticien, est restituée sous
+        le nom affiché : [{"_id": nom, "practitioner_id", "count"}].
+        """
+        counters = {"total": 0, "cancelled": 0, "workload": [], "by_day": []}
+        names = {p["_id"]: p["nom"] for p in self.get_practitioners()}
+        for doc in self.db.stats.find():
+            if doc["kind"] in ("total", "cancelled"):
+                counters[doc["kind"]] = doc["count"]
+            elif doc["count"] > 0 and doc["kind"] == "workload":
+                counters["workload"].append({
+                    "_id": names.get(doc["key"], "Praticien supprimé"),
+                    "practitioner_id": doc["key"],
+                    "count": doc["count"]
+                })
+            elif doc["count"] > 0 and doc["kind"] == "dow":
+                counters["by_day"].append({"_id": doc["key"], "count": doc["count"]})
+        counters["by_day"].sort(key=lambda item: item["_id"])
+        return counters
+
+    def _appointment_stats(self):
+        """Recalcule en un seul aller-retour ($facet) les agrégats de la collection appointments.
+
+        Retourne {"totals": [{total, cancelled}], "workload": [...], "by_day": [...]}.
+        """
+        not_cancelled = {"is_active": True}
+        pipeline = [
+            {"$facet": {
+                "totals": [
+                    {"$group": {
+                        "_id": None,
+                        "total": {"$sum": 1},
+                        "cancelled": {"$sum": {"$cond": ["$is_active", 0, 1]}}
+                    }}
+                ],
+                "workload": [
+                    {"$match": not_cancelled},
+                    {"$group": {"_id": "$practitioner_id", "count": {"$sum": 1}}}
+                ],
+                "by_day": [
+                    {"$match": not_cancelled},
+                    {"$group": {
+                        "_id": {"$dayOfWeek": "$date_heure_debut"},
+                        "count": {"$sum": 1}
+                    }},
+                    {"$sort": {"_id": 1}}
+                ]
+            }}
+        ]
+        return next(self.db.appointments.aggregate(pipeline))
 
     def get_stats_cancellation_rate(self):
         """Calcule le taux d'annulation (tous types confondus)."""
-        total = self.db.appointments.count_documents({})
-        cancelled = self.db.appointments.count_documents({"statut": {"$regex": "^Annulé"}})
-        if total == 0: return 0
-        return (cancelled / total) * 100
+        counters = self._read_stats()
+        if counters["total"] == 0: return 0
+        return (counters["cancelled"] / counters["total"]) * 100
 
     def get_stats_workload(self):
         """Charge de travail par médecin (nombre de RDV non annulés)."""
-        pipeline = [
-            {"$match": {"statut": {"$not": {"$regex": "^Annulé"}}}},
-            {"$group": {"_id": "$practitioner_name", "count": {"$sum": 1}}}
-        ]
-        return list(self.db.appointments.aggregate(pipeline))
+        return self._read_stats()["workload"]
 
     def get_dashboard_stats(self):
         """Retourne les KPIs pour le tableau de bord."""
+        counters = self._read_stats()
+        cancellation_rate = (counters["cancelled"] / counters["total"]) * 100 if counters["total"] else 0
+
         today_start = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
         today_end = datetime.datetime.combine(datetime.date.today(), datetime.time.max)
-
-        total_patients = self.db.patients.count_documents({})
-        total_appointments = self.db.appointments.count_documents({})
         today_appointments = self.db.appointments.count_documents({
             "date_heure_debut": {"$gte": today_start, "$lte": today_end}
         })
-        active_practitioners = self.db.practitioners.count_documents({})
-        cancellation_rate = self.get_stats_cancellation_rate()
-
-        recent_logs = list(self.db.logs.find().sort("timestamp", DESCENDING).limit(5))
 
-        # Appointments by day of week
-        dow_pipeline = [
-            {"$match": {"statut": {"$not": {"$regex": "^Annulé"}}}},
-            {"$group": {
-                "_id": {"$dayOfWeek": "$date_heure_debut"},
-                "count": {"$sum": 1}
-            }},
-            {"$sort": {"_id": 1}}
-        ]
-        appts_by_day = list(self.db.appointments.aggregate(dow_pipeline))
-        day_names = {1: "Dim", 2: "Lun", 3: "Mar", 4: "Mer", 5: "Jeu", 6: "Ven", 7: "Sam"}
+        appts_by_day = counters["by_day"]
         for item in appts_by_day:
-            item["jour"] = day_names.get(item["_id"], "?")
+            item["jour"] = DAY_NAMES.get(item["_id"], "?")
+
+        # Compteurs approximatifs (métadonnées de la collection) : suffisants pour des KPIs
+        total_patients = self.db.patients.estimated_document_count()
+        active_practitioners = self.db.practitioners.estimated_document_count()
+
+        self.audit.flush()
+        recent_logs = list(self.db.logs.find().sort("timestamp", DESCENDING).limit(5))
 
         # Patient growth (by month)
         growth_pipeline = [
@@ -407,12 +1008,21 @@ class DBManager:
 
         return {
             "total_patients": total_patients,
-            "total_appointments": total_appointments,
+            "total_appointments": counters["total"],
             "today_appointments": today_appointments,
             "active_practitioners": active_practitioners,
             "cancellation_rate": cancellation_rate,
             "recent_logs": recent_logs,
             "appts_by_day": appts_by_day,
-            "patient_growth": patient_growth
+            "patient_growth": patient_growth,
+            "workload": counters["workload"]
         }
 
+
+@st.cache_resource(show_spinner=False)
+def get_db_manager():
+    """Retourne le DBManager unique du processus (client et pool partagés par toutes les sessions).
+
+    MongoClient est thread-safe : une seule instance suffit pour tous les onglets ouverts.
+    """
+    return DBManager()
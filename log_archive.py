@@ -0,0 +1,128 @@
+"""Rétention du journal d'audit : fenêtre chaude, expiration TTL et archive froide.
+
+* Les logs plus récents que LOG_RETENTION_DAYS restent dans la collection `logs`.
+* L'archiveur (`python manage.py archive-logs`) écrit les journées plus anciennes
+  dans des segments JSONL compressés, un fichier par jour
+  (`<LOG_ARCHIVE_DIR>/AAAA/MM/logs-AAAA-MM-JJ.jsonl.gz`), puis les supprime de MongoDB.
+* L'index `timestamp` est un index TTL réglé sur la rétention plus une marge
+  (LOG_TTL_GRACE_DAYS) : il ne sert que de filet de sécurité si l'archiveur ne tourne pas.
+* `iter_archived_logs` relit les segments d'une période pour la vue d'administration.
+"""
+import datetime
+import gzip
+import json
+import os
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+LOG_TTL_GRACE_DAYS = int(os.getenv("LOG_TTL_GRACE_DAYS", "7"))
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", os.path.join("archives", "logs"))
+
+
+def hot_cutoff(retention_days=LOG_RETENTION_DAYS, today=None):
+    """Début de la fenêtre chaude : les journées antérieures sont archivables."""
+    today = today or datetime.date.today()
+    return datetime.datetime.combine(today - datetime.timedelta(days=retention_days), datetime.time.min)
+
+
+def apply_ttl(db, retention_days=LOG_RETENTION_DAYS, grace_days=LOG_TTL_GRACE_DAYS):
+    """Fait de l'index existant sur `timestamp` un index TTL (pas de second index)."""
+    expire_after = (retention_days + grace_days) * 86400
+    try:
+        db.command("collMod", "logs", index={"keyPattern": {"timestamp": DESCENDING}, "expireAfterSeconds": expire_after})
+    except OperationFailure:
+        # Serveur < 5.1 ou index absent : on recrée l'index avec l'option TTL
+        try:
+            db.logs.drop_index([("timestamp", DESCENDING)])
+        except OperationFailure:
+            pass
+        db.logs.create_index([("timestamp", DESCENDING)], expireAfterSeconds=expire_after)
+    return expire_after
+
+
+def segment_path(day, archive_dir=LOG_ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"{day:%Y}", f"{day:%m}", f"logs-{day:%Y-%m-%d}.jsonl.gz")
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type non sérialisable : {type(value).__name__}")
+
+
+def _decode(line):
+    entry = json.loads(line)
+    entry["_id"] = ObjectId(entry["_id"])
+    entry["timestamp"] = datetime.datetime.fromisoformat(entry["timestamp"])
+    return entry
+
+
+def archive_logs(db, archive_dir=LOG_ARCHIVE_DIR, retention_days=LOG_RETENTION_DAYS, batch_size=1000):
+    """Archive puis supprime les logs antérieurs à la fenêtre chaude, journée par journée.
+
+    Les logs sont lus en flux (curseur trié sur l'index `timestamp`) ; une journée n'est
+    supprimée de MongoDB qu'une fois son segment écrit et fermé.
+    Retourne {"days": nombre de segments écrits, "logs": nombre de logs archivés}.
+    """
+    cutoff = hot_cutoff(retention_days)
+    cursor = db.logs.find({"timestamp": {"$lt": cutoff}}).sort("timestamp", ASCENDING).batch_size(batch_size)
+
+    summary = {"days": 0, "logs": 0}
+    current_day, segment = None, None
+
+    def close_day():
+        segment.close()
+        day_start = datetime.datetime.combine(current_day, datetime.time.min)
+        db.logs.delete_many({"timestamp": {"$gte": day_start, "$lt": day_start + datetime.timedelta(days=1)}})
+        summary["days"] += 1
+
+    for entry in cursor:
+        day = entry["timestamp"].date()
+        if day != current_day:
+            if segment is not None:
+                close_day()
+            path = segment_path(day, archive_dir)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Mode ajout : un archivage interrompu puis relancé complète le segment
+            segment = gzip.open(path, "at", encoding="utf-8")
+            current_day = day
+        segment.write(json.dumps(entry, default=_encode, ensure_ascii=False) + "\n")
+        summary["logs"] += 1
+    if segment is not None:
+        close_day()
+    return summary
+
+
+def iter_archived_logs(date_from, date_to=None, after=None, user=None, action=None, archive_dir=LOG_ARCHIVE_DIR):
+    """Parcourt les logs archivés de la période, du plus récent au plus ancien.
+
+    Même ordre et même curseur (timestamp, _id) que DBManager.get_logs_page.
+    Un seul segment (une journée) est chargé en mémoire à la fois.
+    """
+    date_to = date_to or datetime.datetime.now()
+    day = date_to.date()
+    while day >= date_from.date():
+        path = segment_path(day, archive_dir)
+        day -= datetime.timedelta(days=1)
+        if not os.path.exists(path):
+            continue
+        entries = {}
+        with gzip.open(path, "rt", encoding="utf-8") as segment:
+            for line in segment:
+                entry = _decode(line)
+                entries[entry["_id"]] = entry  # dédoublonnage après un archivage relancé
+        for entry in sorted(entries.values(), key=lambda e: (e["timestamp"], e["_id"]), reverse=True):
+            if not (date_from <= entry["timestamp"] <= date_to):
+                continue
+            if after and (entry["timestamp"], entry["_id"]) >= after:
+                continue
+            if user and entry.get("user") != user:
+                continue
+            if action and entry.get("action") != action:
+                continue
+            yield entry
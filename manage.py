@@ -0,0 +1,156 @@
+"""Commandes d'exploitation MediGest.
+
+Usage :
+    python manage.py migrate            # applique les étapes de schéma manquantes
+    python manage.py migrate --status   # affiche la version courante
+    python manage.py rebuild-stats      # recalcule la collection stats
+    python manage.py rebuild-schedule   # recalcule les réservations de créneaux
+    python manage.py archive-logs       # archive les logs hors fenêtre chaude
+    python manage.py import-patients patients.csv [--rejects rejets.csv]
+    python manage.py export appointments --format parquet --from 2024-01-01 --to 2024-12-31
+"""
+import argparse
+import datetime
+import sys
+
+import data_export
+import log_archive
+import migrations
+import patient_import
+from db_manager import DBManager
+
+
+def cmd_migrate(manager, args):
+    if args.status:
+        current = migrations.get_schema_version(manager.db)
+        print(f"Version du schéma : {current} (dernière : {migrations.LATEST_VERSION})")
+        return 0
+    applied = migrations.apply_migrations(manager)
+    for version, description in applied:
+        print(f"  [{version}] {description}")
+    print(f"Schéma à jour (version {migrations.get_schema_version(manager.db)}).")
+    return 0
+
+
+def cmd_rebuild_stats(manager, args):
+    count = manager.rebuild_stats()
+    print(f"Collection stats reconstruite ({count} compteurs).")
+    return 0
+
+
+def cmd_rebuild_schedule(manager, args):
+    count = manager.rebuild_schedule()
+    print(f"Réservations reconstruites ({count} journée(s) praticien).")
+    return 0
+
+
+def cmd_archive_logs(manager, args):
+    manager.audit.flush()
+    expire_after = log_archive.apply_ttl(manager.db, args.retention_days)
+    summary = log_archive.archive_logs(manager.db, args.archive_dir, args.retention_days)
+    print(f"{summary['logs']} log(s) archivé(s) dans {summary['days']} segment(s) sous {args.archive_dir}.")
+    print(f"Expiration TTL : {expire_after // 86400} jours.")
+    return 0
+
+
+def cmd_import_patients(manager, args):
+    fmt = args.format or patient_import.detect_format(args.file)
+    with open(args.file, encoding="utf-8-sig", newline="") as stream:
+        summary, rejects = patient_import.import_patients(
+            manager, patient_import.iter_rows(stream, fmt), args.user, args.batch_size
+        )
+    manager.audit.flush()
+    print(f"{summary['imported']} patient(s) importé(s) sur {summary['read']} ligne(s), "
+          f"{summary['rejected']} rejet(s), {summary['batches']} lot(s).")
+    if rejects:
+        rejects_path = args.rejects or args.file + ".rejets.csv"
+        with open(rejects_path, "w", encoding="utf-8", newline="") as report:
+            patient_import.write_rejects_report(rejects, report)
+        print(f"Rapport de rejets : {rejects_path}")
+    return 0
+
+
+def cmd_export(manager, args):
+    if args.dataset == "logs":
+        manager.audit.flush()
+    output = args.output or data_export.export_filename(args.dataset, args.format)
+    # --to est inclus : on exporte jusqu'au lendemain minuit exclu
+    date_from = datetime.datetime.combine(args.date_from, datetime.time.min) if args.date_from else None
+    date_to = datetime.datetime.combine(args.date_to + datetime.timedelta(days=1), datetime.time.min) if args.date_to else None
+    practitioner = None
+    if args.practitioner:
+        # Les RDV référencent le praticien par identifiant : résolution du nom saisi
+        practitioner = next((p["_id"] for p in manager.get_practitioners() if p["nom"] == args.practitioner), None)
+        if practitioner is None:
+            print(f"Praticien inconnu : {args.practitioner}", file=sys.stderr)
+            return 1
+    if args.format == "csv" and args.chunk_rows:
+        query = data_export.build_query(args.dataset, date_from, date_to, practitioner)
+        rows, paths = data_export.write_csv_chunks(
+            data_export.iter_batches(manager.db, args.dataset, query, args.batch_size), output, args.dataset, args.chunk_rows
+        )
+        print(f"{rows} ligne(s) exportée(s) dans {len(paths)} fichier(s) : {', '.join(paths)}")
+        return 0
+    rows = data_export.export(manager.db, args.dataset, args.format, output, date_from, date_to,
+                              practitioner, args.batch_size)
+    print(f"{rows} ligne(s) exportée(s) dans {output}.")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="manage.py", description="Commandes d'exploitation MediGest")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_migrate = sub.add_parser("migrate", help="Applique les migrations de schéma")
+    p_migrate.add_argument("--status", action="store_true", help="Affiche la version sans rien modifier")
+    p_migrate.set_defaults(func=cmd_migrate)
+
+    p_stats = sub.add_parser("rebuild-stats", help="Recalcule les compteurs statistiques")
+    p_stats.set_defaults(func=cmd_rebuild_stats)
+
+    p_schedule = sub.add_parser("rebuild-schedule", help="Recalcule les réservations de créneaux à venir")
+    p_schedule.set_defaults(func=cmd_rebuild_schedule)
+
+    p_archive = sub.add_parser("archive-logs", help="Archive les logs anciens et applique l'expiration TTL")
+    p_archive.add_argument("--retention-days", type=int, default=log_archive.LOG_RETENTION_DAYS,
+                           help="Fenêtre chaude conservée dans MongoDB (jours)")
+    p_archive.add_argument("--archive-dir", default=log_archive.LOG_ARCHIVE_DIR,
+                           help="Répertoire des segments archivés")
+    p_archive.set_defaults(func=cmd_archive_logs)
+
+    p_import = sub.add_parser("import-patients", help="Importe des patients depuis un fichier CSV ou JSONL")
+    p_import.add_argument("file", help="Fichier .csv ou .jsonl")
+    p_import.add_argument("--format", choices=["csv", "jsonl"], help="Format (déduit de l'extension par défaut)")
+    p_import.add_argument("--batch-size", type=int, default=patient_import.IMPORT_BATCH_SIZE,
+                          help="Patients par insert_many")
+    p_import.add_argument("--rejects", help="Chemin du rapport de rejets (défaut : <fichier>.rejets.csv)")
+    p_import.add_argument("--user", default="admin", help="Utilisateur inscrit dans le journal d'audit")
+    p_import.set_defaults(func=cmd_import_patients)
+
+    p_export = sub.add_parser("export", help="Exporte patients, RDV ou logs en CSV / Parquet")
+    p_export.add_argument("dataset", choices=sorted(data_export.DATASETS))
+    p_export.add_argument("--format", choices=sorted(data_export.FORMATS), default="csv")
+    p_export.add_argument("--output", help="Fichier de sortie (défaut : <jeu>_<date>.<ext>)")
+    p_export.add_argument("--from", dest="date_from", type=datetime.date.fromisoformat, help="Début (AAAA-MM-JJ)")
+    p_export.add_argument("--to", dest="date_to", type=datetime.date.fromisoformat, help="Fin incluse (AAAA-MM-JJ)")
+    p_export.add_argument("--practitioner", help="Praticien (RDV uniquement)")
+    p_export.add_argument("--batch-size", type=int, default=data_export.EXPORT_BATCH_SIZE,
+                          help="Documents lus et écrits par lot")
+    p_export.add_argument("--chunk-rows", type=int, help="CSV : découpe en fichiers de N lignes")
+    p_export.set_defaults(func=cmd_export)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # `migrate` gère lui-même l'application des étapes (et --status ne doit rien modifier)
+    manager = DBManager(auto_migrate=args.command != "migrate")
+    if manager.db is None:
+        print("Impossible de se connecter à MongoDB.", file=sys.stderr)
+        return 1
+    return args.func(manager, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""Bootstrap versionné du schéma MongoDB de MediGest.
+
+Chaque étape est numérotée et appliquée une seule fois par base : la version
+atteinte est enregistrée dans la collection `meta`. Au démarrage, si la base
+est déjà à jour, une seule lecture suffit et aucun index n'est recréé.
+
+Pour ajouter un index ou une migration de données, écrire une fonction
+`_mXXX_description(manager)` idempotente et l'ajouter à la fin de `MIGRATIONS`.
+
+Plusieurs processus (workers Streamlit, `manage.py migrate`) peuvent démarrer en même
+temps : un seul applique les étapes, sous un bail (`{_id: "migration_lock"}` dans
+`meta`, avec détenteur et expiration). Les autres attendent la fin du bail puis
+relisent la version.
+"""
+import datetime
+import os
+import socket
+import time
+import uuid
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import log_archive
+import search_keys
+from appointment_status import STATUS_CODES, status_fields
+
+META_COLLECTION = "meta"
+SCHEMA_DOC_ID = "schema"
+LOCK_DOC_ID = "migration_lock"
+
+# Durée du bail, prolongée après chaque étape ; un processus mort le libère à expiration
+MIGRATION_LOCK_SECONDS = int(os.getenv("MIGRATION_LOCK_SECONDS", "600"))
+# Attente max. d'un processus pendant qu'un autre applique les migrations
+MIGRATION_LOCK_WAIT_SECONDS = int(os.getenv("MIGRATION_LOCK_WAIT_SECONDS", "900"))
+MIGRATION_LOCK_POLL_SECONDS = 1.0
+
+
+# --- Étapes ---
+
+def _m001_initial_indexes(manager):
+    """Index de base des collections patients, appointments, logs et users."""
+    db = manager.db
+    db.patients.create_index([("nom", ASCENDING), ("prenom", ASCENDING)])
+    db.appointments.create_index([("date_heure_debut", ASCENDING)])
+    db.appointments.create_index([("practitioner_name", ASCENDING), ("date_heure_debut", ASCENDING)])
+    db.logs.create_index([("timestamp", DESCENDING)])
+    try:
+        db.users.create_index("username", unique=True)
+    except Exception:
+        pass  # Index may already exist or duplicates prevent creation
+
+
+def _m002_default_admin(manager):
+    """Crée un administrateur par défaut si la collection users est vide."""
+    if manager.db.users.count_documents({}) == 0:
+        manager.create_user("admin", "admin123", "Administrateur", "admin")
+
+
+def _m003_stats_counters(manager):
+    """Initialise la collection stats à partir des RDV existants."""
+    manager.rebuild_stats()
+
+
+def _m004_logs_keyset_indexes(manager):
+    """Index de pagination par clé (timestamp, _id) du journal, avec filtres utilisateur / action."""
+    db = manager.db
+    db.logs.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    db.logs.create_index([("user", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+    db.logs.create_index([("action", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+
+
+def _m005_logs_ttl(manager):
+    """Index TTL sur logs.timestamp (rétention + marge, voir log_archive.py)."""
+    log_archive.apply_ttl(manager.db)
+
+
+def _m006_patient_search_keys(manager, batch_size=1000):
+    """Index multiclé sur patients.search_keys et calcul des clés des patients existants."""
+    db = manager.db
+    db.patients.create_index([("search_keys", ASCENDING)])
+    cursor = db.patients.find({"search_keys": {"$exists": False}}, {"nom": 1, "prenom": 1}).batch_size(batch_size)
+    ops = []
+    for pat in cursor:
+        keys = search_keys.patient_search_keys(pat.get("nom", ""), pat.get("prenom", ""))
+        ops.append(UpdateOne({"_id": pat["_id"]}, {"$set": {"search_keys": keys}}))
+        if len(ops) >= batch_size:
+            db.patients.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db.patients.bulk_write(ops, ordered=False)
+
+
+def _m007_appointment_status_model(manager):
+    """Ajoute statut_code / is_active aux RDV et l'index de détection de chevauchement."""
+    db = manager.db
+    for statut in STATUS_CODES:
+        db.appointments.update_many({"statut": statut}, {"$set": status_fields(statut)})
+    # Libellés hors référentiel (saisies anciennes)
+    db.appointments.update_many(
+        {"is_active": {"$exists": False}, "statut": {"$regex": "^Annulé"}},
+        {"$set": {"statut_code": "CANCELLED", "is_active": False}}
+    )
+    db.appointments.update_many(
+        {"is_active": {"$exists": False}},
+        {"$set": {"statut_code": "OTHER", "is_active": True}}
+    )
+    db.appointments.create_index([
+        ("practitioner_name", ASCENDING), ("is_active", ASCENDING),
+        ("date_heure_debut", ASCENDING), ("date_heure_fin", ASCENDING)
+    ])
+    # Remplacé par l'index ci-dessus, dont (practitioner_name) est le préfixe
+    try:
+        db.appointments.drop_index([("practitioner_name", ASCENDING), ("date_heure_debut", ASCENDING)])
+    except Exception:
+        pass
+    manager.rebuild_stats()
+
+
+def _m008_schedule_reservations(manager):
+    """Réservations de créneaux par praticien et par jour (voir scheduling.py)."""
+    manager.db.reservations.create_index([("day", ASCENDING)])
+    manager.rebuild_schedule()
+
+
+def _m009_slot_bitmaps_index(manager):
+    """Index de la collection slot_bitmaps (SCHEDULE_BACKEND=bitmap)."""
+    manager.db.slot_bitmaps.create_index([("day", ASCENDING)])
+
+
+def _m010_visits_collection(manager, batch_size=500):
+    """Déplace patients.historique_visites vers la collection visits, indexée par (patient_id, date)."""
+    db = manager.db
+    db.visits.create_index([("patient_id", ASCENDING), ("date", DESCENDING)])
+    cursor = db.patients.find({"historique_visites": {"$exists": True}}, {"historique_visites": 1}).batch_size(batch_size)
+    visits, patient_ids = [], []
+
+    def flush():
+        if visits:
+            db.visits.insert_many(visits, ordered=False)
+        # Retiré lot par lot : une reprise après interruption ne recopie pas les lots déjà traités
+        db.patients.update_many({"_id": {"$in": patient_ids}}, {"$unset": {"historique_visites": ""}})
+
+    for pat in cursor:
+        for visit in pat.get("historique_visites") or []:
+            visits.append({"patient_id": pat["_id"], **visit})
+        patient_ids.append(pat["_id"])
+        if len(patient_ids) >= batch_size:
+            flush()
+            visits, patient_ids = [], []
+    if patient_ids:
+        flush()
+
+
+def _m011_practitioner_ids(manager):
+    """Référence les praticiens par identifiant dans appointments et visits.
+
+    Le nom reste sur les documents comme libellé d'affichage. Un nom sans fiche
+    praticien (praticien renommé avant cette étape) reçoit une fiche, pour qu'aucun
+    RDV ne reste orphelin.
+    """
+    db = manager.db
+    by_name = {p["nom"]: p["_id"] for p in db.practitioners.find({}, {"nom": 1})}
+    missing = {"practitioner_id": {"$exists": False}}
+    orphans = (set(db.appointments.distinct("practitioner_name", missing))
+               | set(db.visits.distinct("practitioner", missing))) - set(by_name) - {None, ""}
+    for nom in sorted(orphans):
+        by_name[nom] = db.practitioners.insert_one({
+            "nom": nom,
+            "specialite": "Non renseignée",
+            "created_at": datetime.datetime.now()
+        }).inserted_id
+    for nom, practitioner_id in by_name.items():
+        db.appointments.update_many({"practitioner_name": nom, **missing}, {"$set": {"practitioner_id": practitioner_id}})
+        db.visits.update_many({"practitioner": nom, **missing}, {"$set": {"practitioner_id": practitioner_id}})
+
+    db.appointments.create_index([
+        ("practitioner_id", ASCENDING), ("is_active", ASCENDING),
+        ("date_heure_debut", ASCENDING), ("date_heure_fin", ASCENDING)
+    ])
+    try:
+        db.appointments.drop_index([
+            ("practitioner_name", ASCENDING), ("is_active", ASCENDING),
+            ("date_heure_debut", ASCENDING), ("date_heure_fin", ASCENDING)
+        ])
+    except Exception:
+        pass
+    # Recopie du nom lors d'un renommage (update_practitioner)
+    db.visits.create_index([("practitioner_id", ASCENDING)])
+
+    # Registre des créneaux et compteurs désormais indexés par identifiant : les documents
+    # indexés par nom (écrits par l'étape 8 avant cette version) sont supprimés
+    db.reservations.delete_many({})
+    db.slot_bitmaps.delete_many({})
+    manager.reference.invalidate("practitioners")
+    manager.rebuild_schedule()
+    manager.rebuild_stats()
+
+
+def _m012_transliterated_search_keys(manager, batch_size=1000):
+    """Recalcule les clés de recherche des noms contenant des lettres translittérées (ø, ß, œ...)."""
+    db = manager.db
+    pattern = {"$regex": f"[{''.join(search_keys.TRANSLITERATIONS)}]"}
+    cursor = db.patients.find({"$or": [{"nom": pattern}, {"prenom": pattern}]},
+                              {"nom": 1, "prenom": 1}).batch_size(batch_size)
+    ops = []
+    for pat in cursor:
+        keys = search_keys.patient_search_keys(pat.get("nom", ""), pat.get("prenom", ""))
+        ops.append(UpdateOne({"_id": pat["_id"]}, {"$set": {"search_keys": keys}}))
+        if len(ops) >= batch_size:
+            db.patients.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db.patients.bulk_write(ops, ordered=False)
+
+
+MIGRATIONS = [
+    (1, "Index initiaux", _m001_initial_indexes),
+    (2, "Administrateur par défaut", _m002_default_admin),
+    (3, "Compteurs statistiques", _m003_stats_counters),
+    (4, "Index de pagination des logs", _m004_logs_keyset_indexes),
+    (5, "Expiration TTL des logs", _m005_logs_ttl),
+    (6, "Clés de recherche des patients", _m006_patient_search_keys),
+    (7, "Modèle de statut des RDV", _m007_appointment_status_model),
+    (8, "Réservations de créneaux", _m008_schedule_reservations),
+    (9, "Champs de bits des créneaux", _m009_slot_bitmaps_index),
+    (10, "Historique des visites hors du dossier patient", _m010_visits_collection),
+    (11, "Praticiens référencés par identifiant", _m011_practitioner_ids),
+    (12, "Clés de recherche des lettres translittérées", _m012_transliterated_search_keys),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# --- Application ---
+
+def get_schema_version(db):
+    """Version du schéma appliquée sur la base (0 si jamais initialisée)."""
+    doc = db[META_COLLECTION].find_one({"_id": SCHEMA_DOC_ID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+
+def _acquire_lock(meta, holder, lease_seconds):
+    """Prend (ou prolonge) le bail de migration ; faux s'il est détenu par un autre processus."""
+    now = datetime.datetime.now()
+    try:
+        doc = meta.find_one_and_update(
+            {"_id": LOCK_DOC_ID, "$or": [{"holder": holder}, {"expires_at": {"$lt": now}}]},
+            {"$set": {
+                "holder": holder,
+                "expires_at": now + datetime.timedelta(seconds=lease_seconds),
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Bail existant, valide et détenu par un autre : l'upsert a tenté de recréer le document
+        return False
+    return doc is not None and doc.get("holder") == holder
+
+
+def _release_lock(meta, holder):
+    meta.delete_one({"_id": LOCK_DOC_ID, "holder": holder})
+
+
+def apply_migrations(manager, wait_seconds=MIGRATION_LOCK_WAIT_SECONDS, lease_seconds=MIGRATION_LOCK_SECONDS):
+    """Applique dans l'ordre les étapes non encore appliquées, sous le bail de migration.
+
+    Si un autre processus détient le bail, attend au plus `wait_seconds` qu'il le libère
+    (RuntimeError au-delà), puis relit la version : les étapes déjà appliquées par
+    l'autre processus ne sont pas rejouées.
+    Retourne la liste des (version, description) appliquées ; vide si la base est à jour.
+    """
+    db = manager.db
+    meta = db[META_COLLECTION]
+    if get_schema_version(db) >= LATEST_VERSION:
+        return []
+
+    holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    deadline = time.monotonic() + wait_seconds
+    while not _acquire_lock(meta, holder, lease_seconds):
+        if time.monotonic() >= deadline:
+            raise RuntimeError("Migrations en cours dans un autre processus : délai d'attente dépassé.")
+        time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+        if get_schema_version(db) >= LATEST_VERSION:
+            return []
+
+    applied = []
+    try:
+        # Version relue sous le bail : un autre processus a pu avancer entre-temps
+        current = get_schema_version(db)
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            step(manager)
+            meta.update_one(
+                {"_id": SCHEMA_DOC_ID},
+                {
+                    "$max": {"version": version},
+                    "$push": {"history": {
+                        "version": version,
+                        "description": description,
+                        "applied_at": datetime.datetime.now()
+                    }}
+                },
+                upsert=True
+            )
+            applied.append((version, description))
+            if not _acquire_lock(meta, holder, lease_seconds):
+                raise RuntimeError("Bail de migration perdu : une étape a dépassé MIGRATION_LOCK_SECONDS.")
+    finally:
+        _release_lock(meta, holder)
+    return applied
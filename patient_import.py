@@ -0,0 +1,154 @@
+"""Import en masse de patients depuis un fichier CSV ou JSONL.
+
+Le fichier est lu en flux (générateur ligne à ligne) : seul le lot en cours est en
+mémoire. Chaque ligne est validée et normalisée comme dans `create_patient`
+(`build_patient_doc`), puis les lots sont écrits par `insert_many(ordered=False)`
+avec une seule entrée de journal par lot. Les lignes rejetées sont collectées pour
+un rapport CSV (`write_rejects_report`).
+
+Colonnes reconnues : nom, prenom, telephone (ou tel), email, assurance,
+notes_medicales (ou notes). Les autres colonnes sont ignorées.
+"""
+import csv
+import io
+import json
+import os
+
+from pymongo.errors import BulkWriteError
+
+from db_manager import build_patient_doc
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+# Nom de colonne accepté -> paramètre de build_patient_doc
+_COLUMNS = {
+    "nom": "nom",
+    "prenom": "prenom",
+    "telephone": "phone",
+    "tel": "phone",
+    "email": "email",
+    "assurance": "assurance",
+    "notes_medicales": "notes",
+    "notes": "notes",
+}
+
+
+def detect_format(filename):
+    """"csv" ou "jsonl" d'après l'extension du fichier."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Format non reconnu : {ext or filename} (attendu : .csv, .jsonl)")
+
+
+def iter_rows(stream, fmt):
+    """Génère (numéro de ligne, dict) depuis un flux texte CSV ou JSONL.
+
+    Une ligne JSONL illisible est générée sous la forme {"_error": motif, "_line": texte},
+    pour finir dans le rapport de rejets sans interrompre l'import.
+    """
+    if fmt == "csv":
+        sample = stream.read(4096)
+        stream.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(stream, dialect=dialect)
+        # Ligne 1 = en-tête
+        for line_no, row in enumerate(reader, start=2):
+            yield line_no, row
+    elif fmt == "jsonl":
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, {"_error": f"JSON invalide : {e}", "_line": line.rstrip("\r\n")}
+                continue
+            if not isinstance(row, dict):
+                row = {"_error": "Objet JSON attendu", "_line": line.rstrip("\r\n")}
+            yield line_no, row
+    else:
+        raise ValueError(f"Format inconnu : {fmt}")
+
+
+def normalize_row(row):
+    """Document patient prêt à insérer, ou ValueError avec le motif du rejet."""
+    if row.get("_error"):
+        raise ValueError(row["_error"])
+    fields = {param: "" for param in set(_COLUMNS.values())}
+    for column, value in row.items():
+        param = _COLUMNS.get((column or "").strip().lower())
+        if param and value is not None:
+            fields[param] = str(value).strip()
+    if not fields["nom"] or not fields["prenom"]:
+        raise ValueError("Nom et Prenom obligatoires")
+    return build_patient_doc(**fields)
+
+
+def import_patients(manager, rows, imported_by, batch_size=IMPORT_BATCH_SIZE):
+    """Importe les lignes (numéro, dict) produites par `iter_rows`.
+
+    Retourne (résumé, rejets) : résumé = {"read", "imported", "rejected", "batches"},
+    rejets = [(numéro de ligne, motif, ligne brute)].
+    """
+    summary = {"read": 0, "imported": 0, "rejected": 0, "batches": 0}
+    rejects = []
+    batch, batch_lines = [], []
+
+    def flush():
+        inserted = len(batch)
+        try:
+            manager.db.patients.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            for error in e.details.get("writeErrors", []):
+                line_no, raw = batch_lines[error["index"]]
+                rejects.append((line_no, error.get("errmsg", "Erreur d'écriture"), raw))
+        summary["batches"] += 1
+        summary["imported"] += inserted
+        manager.log_action(
+            imported_by, "IMPORT_PATIENTS",
+            f"Lot {summary['batches']} : {inserted} patient(s) importé(s) "
+            f"(lignes {batch_lines[0][0]} à {batch_lines[-1][0]})"
+        )
+
+    for line_no, raw in rows:
+        summary["read"] += 1
+        try:
+            doc = normalize_row(raw)
+        except ValueError as e:
+            rejects.append((line_no, str(e), raw))
+            continue
+        batch.append(doc)
+        batch_lines.append((line_no, raw))
+        if len(batch) >= batch_size:
+            flush()
+            batch, batch_lines = [], []
+    if batch:
+        flush()
+
+    summary["rejected"] = len(rejects)
+    # Les nouveaux patients seront intégrés à l'autocomplétion au prochain accès
+    manager.autocomplete.invalidate()
+    return summary, rejects
+
+
+def write_rejects_report(rejects, stream):
+    """Écrit le rapport de rejets (ligne, motif, données) au format CSV."""
+    writer = csv.writer(stream)
+    writer.writerow(["ligne", "motif", "donnees"])
+    for line_no, reason, raw in rejects:
+        data = raw["_line"] if "_line" in raw else json.dumps(raw, ensure_ascii=False, default=str)
+        writer.writerow([line_no, reason, data])
+
+
+def rejects_report_csv(rejects):
+    """Rapport de rejets sous forme de texte CSV (bouton de téléchargement)."""
+    buffer = io.StringIO()
+    write_rejects_report(rejects, buffer)
+    return buffer.getvalue()
@@ -0,0 +1,271 @@
+"""Mesure de la latence de chaque commande MongoDB, attribuée à la méthode DBManager appelante.
+
+Un `CommandListener` pymongo, enregistré sur le `MongoClient`, reçoit chaque commande
+(durée, collection, type, nombre de documents renvoyés ou écrits). La méthode publique
+de `DBManager` en cours d'exécution est portée par une variable de contexte posée par
+le décorateur `instrument` : seule la méthode la plus externe est retenue, de sorte
+qu'un appel interne (ex. `_attach_patient_names`) est compté pour la méthode qui l'a
+déclenché. Les écritures du thread d'audit apparaissent sous « arrière-plan ».
+
+Les mesures sont agrégées dans des histogrammes glissants (une tranche par minute,
+fenêtre de `QUERY_STATS_WINDOW_MINUTES`) et les commandes plus lentes que
+`SLOW_QUERY_MS` sont conservées dans un journal borné et émises en avertissement.
+"""
+import contextvars
+import datetime
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from pymongo import monitoring
+
+# "on" (par défaut) ou "off" pour ne pas enregistrer le listener
+QUERY_MONITORING = os.getenv("QUERY_MONITORING", "on")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+QUERY_STATS_WINDOW_MINUTES = int(os.getenv("QUERY_STATS_WINDOW_MINUTES", "15"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+
+# Bornes supérieures (ms) des classes de l'histogramme ; une dernière classe pour le reste
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+BACKGROUND = "arrière-plan"
+
+logger = logging.getLogger(__name__)
+
+_current_operation = contextvars.ContextVar("medigest_db_operation", default=None)
+
+
+def current_operation():
+    """Méthode DBManager en cours dans ce contexte (None hors DBManager)."""
+    return _current_operation.get()
+
+
+def instrument(cls):
+    """Décorateur de classe : chaque méthode publique marque l'opération en cours."""
+    for name, attr in list(vars(cls).items()):
+        if name.startswith("_") or not callable(attr):
+            continue
+        setattr(cls, name, _tagged(attr, f"{cls.__name__}.{name}"))
+    return cls
+
+
+def _tagged(func, label):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current_operation.get() is not None:
+            return func(*args, **kwargs)
+        token = _current_operation.set(label)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_operation.reset(token)
+    return wrapper
+
+
+def _collection(command_name, command):
+    if command_name == "getMore":
+        return command.get("collection")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else None
+
+
+def _filter_shape(command_name, command):
+    """Champs filtrés (sans les valeurs, qui peuvent contenir des données patient)."""
+    if command_name in ("find", "count", "distinct"):
+        query = command.get("filter") or command.get("query") or {}
+    elif command_name == "findAndModify":
+        query = command.get("query") or {}
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        query = statements[0].get("q") or {}
+    elif command_name == "aggregate":
+        first = (command.get("pipeline") or [{}])[0]
+        query = first.get("$match") or {}
+    else:
+        return ""
+    return ", ".join(sorted(query))
+
+
+def _result_size(command_name, reply):
+    cursor = reply.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+
+class _Histogram:
+    __slots__ = ("counts", "count", "errors", "total_ms", "max_ms", "docs")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.docs = 0
+
+    def add(self, duration_ms, docs, failed):
+        index = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if duration_ms <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.errors += failed
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.docs += docs
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.errors += other.errors
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        self.docs += other.docs
+
+    def percentile(self, q):
+        """Borne supérieure de la classe contenant le q-ième percentile (max pour la dernière)."""
+        threshold = q / 100 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= threshold:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+
+class QueryMonitor(monitoring.CommandListener):
+    """Listener de commandes : histogrammes glissants par (méthode, collection, commande)."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, window_minutes=QUERY_STATS_WINDOW_MINUTES,
+                 slow_log_size=SLOW_QUERY_LOG_SIZE):
+        self.slow_ms = slow_ms
+        self.window_minutes = window_minutes
+        self._lock = threading.Lock()
+        self._pending = {}
+        # minute (epoch // 60) -> {(méthode, collection, commande): _Histogram}
+        self._slots = {}
+        self._slow = deque(maxlen=slow_log_size)
+
+    # --- Événements pymongo (émis dans le thread qui exécute la commande) ---
+
+    def started(self, event):
+        command = event.command
+        self._pending[(event.connection_id, event.request_id)] = (
+            _current_operation.get() or BACKGROUND,
+            _collection(event.command_name, command),
+            _filter_shape(event.command_name, command),
+        )
+
+    def succeeded(self, event):
+        self._record(event, _result_size(event.command_name, event.reply), failed=False)
+
+    def failed(self, event):
+        self._record(event, 0, failed=True)
+
+    def _record(self, event, docs, failed):
+        context = self._pending.pop((event.connection_id, event.request_id), None)
+        if context is None:
+            return
+        operation, collection, shape = context
+        duration_ms = event.duration_micros / 1000
+        key = (operation, collection or "-", event.command_name)
+        minute = int(time.time() // 60)
+        with self._lock:
+            slot = self._slots.get(minute)
+            if slot is None:
+                slot = self._slots[minute] = {}
+                for old in [m for m in self._slots if m <= minute - self.window_minutes]:
+                    del self._slots[old]
+            hist = slot.get(key)
+            if hist is None:
+                hist = slot[key] = _Histogram()
+            hist.add(duration_ms, docs, failed)
+        if duration_ms >= self.slow_ms:
+            entry = {
+                "timestamp": datetime.datetime.now(),
+                "operation": operation,
+                "collection": key[1],
+                "command": event.command_name,
+                "filter": shape,
+                "duration_ms": round(duration_ms, 1),
+                "docs": docs,
+                "failed": failed,
+            }
+            self._slow.append(entry)
+            logger.warning(
+                "Requête lente : %s %s.%s (%s) %.1f ms, %d doc(s)",
+                operation, key[1], event.command_name, shape or "sans filtre", duration_ms, docs
+            )
+
+    # --- Lecture des agrégats ---
+
+    def _window(self):
+        cutoff = int(time.time() // 60) - self.window_minutes
+        merged = {}
+        with self._lock:
+            for minute, slot in self._slots.items():
+                if minute <= cutoff:
+                    continue
+                for key, hist in slot.items():
+                    merged.setdefault(key, _Histogram()).merge(hist)
+        return merged
+
+    def top_offenders(self, limit=10, sort="total_ms"):
+        """Agrégats de la fenêtre, triés par `sort` (total_ms, p95_ms, max_ms ou count)."""
+        rows = []
+        for (operation, collection, command), hist in self._window().items():
+            rows.append({
+                "operation": operation,
+                "collection": collection,
+                "command": command,
+                "count": hist.count,
+                "errors": hist.errors,
+                "total_ms": round(hist.total_ms, 1),
+                "mean_ms": round(hist.total_ms / hist.count, 2),
+                "p50_ms": hist.percentile(50),
+                "p95_ms": hist.percentile(95),
+                "p99_ms": hist.percentile(99),
+                "max_ms": round(hist.max_ms, 1),
+                "mean_docs": round(hist.docs / hist.count, 1),
+            })
+        rows.sort(key=lambda r: r[sort], reverse=True)
+        return rows[:limit]
+
+    def histogram(self, operation=None):
+        """Répartition des durées sur la fenêtre : [(libellé de classe, nombre)]."""
+        total = _Histogram()
+        for key, hist in self._window().items():
+            if operation is None or key[0] == operation:
+                total.merge(hist)
+        labels = [f"≤ {b} ms" for b in LATENCY_BUCKETS_MS] + [f"> {LATENCY_BUCKETS_MS[-1]} ms"]
+        return list(zip(labels, total.counts))
+
+    def slow_queries(self, limit=50):
+        """Dernières requêtes lentes, la plus récente en premier."""
+        with self._lock:
+            entries = list(self._slow)
+        return entries[::-1][:limit]
+
+    def reset(self):
+        with self._lock:
+            self._slots.clear()
+            self._slow.clear()
+
+
+# Instance unique du processus, partagée par le client MongoDB et la vue d'administration
+query_monitor = QueryMonitor()
+
+
+def listeners():
+    """Listeners à passer au MongoClient (aucun si la mesure est désactivée)."""
+    return [query_monitor] if QUERY_MONITORING != "off" else []
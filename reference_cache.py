@@ -0,0 +1,56 @@
+"""Cache mémoire des données de référence (praticiens, utilisateurs).
+
+Partagé par toutes les sessions du processus. Chaque jeu de données porte un numéro
+de génération stocké dans le document `{_id: "reference_data"}` de la collection
+`meta` ; une écriture incrémente la génération (`invalidate`), ce qui force le
+rechargement dans tous les processus. La génération n'est relue qu'au plus toutes les
+`REFERENCE_CACHE_CHECK_SECONDS` : entre deux vérifications, une lecture ne fait aucune
+requête.
+"""
+import os
+import threading
+import time
+
+REFERENCE_CACHE_CHECK_SECONDS = float(os.getenv("REFERENCE_CACHE_CHECK_SECONDS", "5"))
+
+GENERATIONS_ID = "reference_data"
+
+
+class ReferenceCache:
+    """Listes de documents mises en cache par nom, cohérentes entre processus."""
+
+    def __init__(self, meta_collection, check_seconds=REFERENCE_CACHE_CHECK_SECONDS):
+        self.meta = meta_collection
+        self.check_seconds = check_seconds
+        # nom -> (génération, documents, instant de la dernière vérification)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _generation(self, name):
+        doc = self.meta.find_one({"_id": GENERATIONS_ID}, {name: 1}) or {}
+        return doc.get(name, 0)
+
+    def get(self, name, loader):
+        """Copie des documents `name`, rechargés par `loader()` si la génération a changé."""
+        entry = self._entries.get(name)
+        now = time.monotonic()
+        if entry is None or now - entry[2] >= self.check_seconds:
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is None or now - entry[2] >= self.check_seconds:
+                    # Génération lue avant le chargement : une écriture concurrente
+                    # sera vue à la vérification suivante
+                    generation = self._generation(name)
+                    if entry is None or entry[0] != generation:
+                        entry = (generation, loader(), now)
+                    else:
+                        entry = (generation, entry[1], now)
+                    self._entries[name] = entry
+        # Les appelants peuvent modifier les documents reçus sans toucher au cache
+        return [dict(doc) for doc in entry[1]]
+
+    def invalidate(self, name):
+        """Incrémente la génération de `name` (tous les processus rechargeront) et vide la copie locale."""
+        self.meta.update_one({"_id": GENERATIONS_ID}, {"$inc": {name: 1}}, upsert=True)
+        with self._lock:
+            self._entries.pop(name, None)
@@ -0,0 +1,458 @@
+"""Réservation atomique des créneaux des praticiens.
+
+La vérification « compter les chevauchements puis insérer » laisse passer deux
+réservations simultanées du même créneau. Ici, chaque (praticien, jour) a un
+document dans la collection `reservations` qui liste les intervalles occupés :
+
+    {"_id": "<practitioner_id>|2024-03-12", "practitioner": ObjectId(<praticien>), "day": ISODate(...),
+     "slots": [{"s": ISODate(...), "e": ISODate(...), "id": ObjectId(<RDV>)}]}
+
+Réserver est une seule mise à jour conditionnelle : le `$push` n'a lieu que si aucun
+intervalle du document ne chevauche le nouveau. MongoDB évalue le filtre et applique
+la mise à jour de façon atomique sur le document, donc deux réservations concurrentes
+du même praticien le même jour sont sérialisées, sans verrou global : les autres
+praticiens et les autres jours ne sont pas bloqués.
+
+Variante `SlotBitmaps` (SCHEDULE_BACKEND=bitmap) : le document (praticien, jour) de
+la collection `slot_bitmaps` porte un champ de bits, un bit par créneau de
+SCHEDULE_BITMAP_SLOT_MINUTES. Réserver = `$bit or` conditionné par `$bitsAllClear`
+sur les bits du RDV ; le test de chevauchement est une opération sur les bits d'un
+seul petit document, quel que soit le nombre de RDV de la journée. Les horaires
+sont arrondis vers l'extérieur au créneau près.
+
+Le module fournit aussi le calcul des créneaux libres (`free_gaps`, `slot_starts`)
+dans les heures d'ouverture du cabinet.
+"""
+import datetime
+import os
+
+from bson.int64 import Int64
+from pymongo.errors import DuplicateKeyError
+
+# "intervals" (liste d'intervalles) ou "bitmap" (champ de bits par créneau)
+SCHEDULE_BACKEND = os.getenv("SCHEDULE_BACKEND", "intervals")
+SCHEDULE_BITMAP_SLOT_MINUTES = int(os.getenv("SCHEDULE_BITMAP_SLOT_MINUTES", "5"))
+
+# Heures d'ouverture utilisées pour proposer des créneaux libres
+SCHEDULE_OPEN_TIME = datetime.time.fromisoformat(os.getenv("SCHEDULE_OPEN_TIME", "08:00"))
+SCHEDULE_CLOSE_TIME = datetime.time.fromisoformat(os.getenv("SCHEDULE_CLOSE_TIME", "19:00"))
+# Jours ouvrés (1 = lundi ... 7 = dimanche), séparés par des virgules
+SCHEDULE_WORK_DAYS = frozenset(int(d) for d in os.getenv("SCHEDULE_WORK_DAYS", "1,2,3,4,5,6").split(",") if d.strip())
+# Pas entre deux heures de début proposées
+SCHEDULE_SLOT_STEP_MINUTES = int(os.getenv("SCHEDULE_SLOT_STEP_MINUTES", "15"))
+# Nombre max. d'occurrences d'une série de RDV récurrents
+SERIES_MAX_OCCURRENCES = int(os.getenv("SERIES_MAX_OCCURRENCES", "52"))
+
+
+def _ms(dt):
+    """Tronque à la milliseconde (précision des dates BSON) pour des comparaisons exactes."""
+    return dt.replace(microsecond=dt.microsecond // 1000 * 1000)
+
+
+def days_covered(start, end):
+    """Jours calendaires touchés par l'intervalle [start, end[."""
+    day = start.date()
+    last = (end - datetime.timedelta(microseconds=1)).date()
+    days = []
+    while day <= last:
+        days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def opening_windows(date_from, date_to, open_time=SCHEDULE_OPEN_TIME, close_time=SCHEDULE_CLOSE_TIME,
+                    work_days=SCHEDULE_WORK_DAYS):
+    """Plages d'ouverture [début, fin[ des jours ouvrés de date_from à date_to inclus."""
+    windows = []
+    day = date_from
+    while day <= date_to:
+        if day.isoweekday() in work_days:
+            windows.append((datetime.datetime.combine(day, open_time), datetime.datetime.combine(day, close_time)))
+        day += datetime.timedelta(days=1)
+    return windows
+
+
+def free_gaps(busy, windows):
+    """Intervalles libres des plages `windows` (triées) hors des intervalles `busy`.
+
+    Balayage après tri : les intervalles occupés, triés par début, sont parcourus une
+    fois en avançant un curseur ; les chevauchements entre RDV sont absorbés par
+    `max(curseur, fin)`. O(n log n) pour le tri, puis linéaire.
+    """
+    busy = sorted(busy)
+    gaps = []
+    first = 0
+    for w_start, w_end in windows:
+        # Intervalles terminés avant la plage : inutiles pour celle-ci et les suivantes
+        while first < len(busy) and busy[first][1] <= w_start:
+            first += 1
+        cursor = w_start
+        i = first
+        while i < len(busy) and busy[i][0] < w_end:
+            start, end = busy[i]
+            if start > cursor:
+                gaps.append((cursor, start))
+            cursor = max(cursor, end)
+            i += 1
+        if cursor < w_end:
+            gaps.append((cursor, w_end))
+    return gaps
+
+
+def slot_starts(gap_start, gap_end, duration, step_minutes=SCHEDULE_SLOT_STEP_MINUTES, not_before=None):
+    """Heures de début alignées sur le pas où un RDV de `duration` tient dans le trou."""
+    start = max(gap_start, not_before) if not_before else gap_start
+    midnight = datetime.datetime.combine(start.date(), datetime.time.min)
+    step = datetime.timedelta(minutes=step_minutes)
+    # Arrondi au pas supérieur, compté depuis minuit
+    start = midnight + -(-(start - midnight) // step) * step
+    starts = []
+    while start + duration <= gap_end:
+        starts.append(start)
+        start += step
+    return starts
+
+
+def weekly_occurrences(first_start, interval_weeks=1, until=None, count=None, max_count=SERIES_MAX_OCCURRENCES):
+    """Débuts d'une série « toutes les `interval_weeks` semaines » (équivalent RRULE FREQ=WEEKLY).
+
+    La série s'arrête au jour `until` inclus et/ou après `count` occurrences, et en
+    tout cas après `max_count`. L'heure de début reste la même (heure locale).
+    Lève ValueError si la série serait vide (`until` antérieur au premier début).
+    """
+    if interval_weeks < 1:
+        raise ValueError("L'intervalle doit être d'au moins une semaine")
+    if until is None and count is None:
+        raise ValueError("Indiquer une date de fin ou un nombre d'occurrences")
+    limit = min(count, max_count) if count is not None else max_count
+    step = datetime.timedelta(weeks=interval_weeks)
+    starts = []
+    start = first_start
+    while len(starts) < limit and (until is None or start.date() <= until):
+        starts.append(start)
+        start += step
+    if not starts:
+        raise ValueError("La date de fin précède la première occurrence")
+    return starts
+
+
+def overlapping(candidates, busy):
+    """Indices des intervalles `candidates` (triés par début) qui chevauchent un intervalle `busy`.
+
+    Même balayage que `free_gaps` : les deux listes triées sont parcourues une fois,
+    les intervalles occupés terminés avant un candidat ne sont plus examinés.
+    """
+    busy = sorted(busy)
+    conflicts = []
+    first = 0
+    for index, (start, end) in enumerate(candidates):
+        start, end = _ms(start), _ms(end)
+        while first < len(busy) and busy[first][1] <= start:
+            first += 1
+        i = first
+        while i < len(busy) and busy[i][0] < end:
+            if busy[i][1] > start:
+                conflicts.append(index)
+                break
+            i += 1
+    return conflicts
+
+
+class IntervalReservations:
+    """Registre des créneaux occupés, un document par praticien et par jour."""
+
+    name = "intervals"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    @staticmethod
+    def _doc_id(practitioner, day):
+        return f"{practitioner}|{day:%Y-%m-%d}"
+
+    def _reserve_day(self, practitioner, day, start, end, appt_id, ignore_id=None):
+        conflict = {"s": {"$lt": end}, "e": {"$gt": start}}
+        if ignore_id is not None:
+            conflict["id"] = {"$ne": ignore_id}
+        doc_id = self._doc_id(practitioner, day)
+        query = {"_id": doc_id, "slots": {"$not": {"$elemMatch": conflict}}}
+        update = {
+            "$push": {"slots": {"s": start, "e": end, "id": appt_id}},
+            "$setOnInsert": {
+                "practitioner": practitioner,
+                "day": datetime.datetime.combine(day, datetime.time.min)
+            }
+        }
+        try:
+            # Si le document existe mais qu'un intervalle chevauche, le filtre échoue et
+            # l'upsert tente d'insérer un _id déjà présent : DuplicateKeyError = conflit.
+            self.collection.update_one(query, update, upsert=True)
+            return True
+        except DuplicateKeyError:
+            # Soit conflit réel, soit document créé entre-temps par une réservation
+            # concurrente : on rejoue sans upsert pour trancher.
+            return self.collection.update_one(query, update).modified_count == 1
+
+    def _release_day(self, practitioner, day, start, end, appt_id):
+        self.collection.update_one(
+            {"_id": self._doc_id(practitioner, day)},
+            {"$pull": {"slots": {"id": appt_id, "s": start, "e": end}}}
+        )
+
+    def reserve(self, practitioner, start, end, appt_id, ignore_id=None):
+        """Réserve [start, end[ pour le RDV `appt_id` ; False si le créneau est pris.
+
+        `ignore_id` exclut un RDV de la détection (ses propres créneaux lors d'un déplacement).
+        """
+        start, end = _ms(start), _ms(end)
+        reserved = []
+        for day in days_covered(start, end):
+            if not self._reserve_day(practitioner, day, start, end, appt_id, ignore_id):
+                for done in reserved:
+                    self._release_day(practitioner, done, start, end, appt_id)
+                return False
+            reserved.append(day)
+        return True
+
+    def release(self, practitioner, start, end, appt_id):
+        """Libère le créneau [start, end[ du RDV `appt_id`."""
+        start, end = _ms(start), _ms(end)
+        for day in days_covered(start, end):
+            self._release_day(practitioner, day, start, end, appt_id)
+
+    def begin_move(self, practitioner, old_start, old_end, new_start, new_end, appt_id):
+        """Première phase d'un déplacement : réserve le nouveau créneau sans libérer l'ancien.
+
+        Retourne le déplacement en attente, à passer à `commit_move` (libère l'ancien
+        créneau) ou à `abort_move` (libère le nouveau) ; None si le créneau est pris.
+        """
+        old = (_ms(old_start), _ms(old_end))
+        new = (_ms(new_start), _ms(new_end))
+        if old != new and not self.reserve(practitioner, new[0], new[1], appt_id, ignore_id=appt_id):
+            return None
+        return {"practitioner": practitioner, "appt_id": appt_id, "old": old, "new": new}
+
+    def commit_move(self, pending):
+        if pending["old"] != pending["new"]:
+            self.release(pending["practitioner"], *pending["old"], pending["appt_id"])
+
+    def abort_move(self, pending):
+        if pending["old"] != pending["new"]:
+            self.release(pending["practitioner"], *pending["new"], pending["appt_id"])
+
+    def move(self, practitioner, old_start, old_end, new_start, new_end, appt_id):
+        """Déplace le créneau d'un RDV ; l'ancien n'est libéré qu'une fois le nouveau acquis."""
+        pending = self.begin_move(practitioner, old_start, old_end, new_start, new_end, appt_id)
+        if pending is None:
+            return False
+        self.commit_move(pending)
+        return True
+
+    def busy_intervals(self, practitioners, start, end):
+        """Intervalles occupés {praticien: [(début, fin)]} entre start et end."""
+        busy = {practitioner: set() for practitioner in practitioners}
+        cursor = self.collection.find(
+            {"practitioner": {"$in": list(practitioners)},
+             "day": {"$gte": datetime.datetime.combine(start.date(), datetime.time.min), "$lt": end}},
+            {"practitioner": 1, "slots.s": 1, "slots.e": 1}
+        )
+        for doc in cursor:
+            # Un RDV à cheval sur minuit figure dans deux documents : le set dédoublonne
+            busy[doc["practitioner"]].update((slot["s"], slot["e"]) for slot in doc["slots"])
+        return {practitioner: sorted(intervals) for practitioner, intervals in busy.items()}
+
+    def rebuild(self, appointments, since):
+        """Reconstruit les réservations à partir de `since` depuis les RDV actifs fournis.
+
+        `appointments` : itérable de RDV actifs (practitioner_id, date_heure_debut,
+        date_heure_fin, _id) se terminant après `since`. Retourne le nombre de documents écrits.
+        """
+        docs = {}
+        for appt in appointments:
+            practitioner = appt["practitioner_id"]
+            start, end = _ms(appt["date_heure_debut"]), _ms(appt["date_heure_fin"])
+            for day in days_covered(start, end):
+                doc = docs.setdefault(self._doc_id(practitioner, day), {
+                    "_id": self._doc_id(practitioner, day),
+                    "practitioner": practitioner,
+                    "day": datetime.datetime.combine(day, datetime.time.min),
+                    "slots": []
+                })
+                doc["slots"].append({"s": start, "e": end, "id": appt["_id"]})
+        self.collection.delete_many({"day": {"$gte": datetime.datetime.combine(since.date(), datetime.time.min)}})
+        if docs:
+            self.collection.insert_many(list(docs.values()), ordered=False)
+        return len(docs)
+
+
+class SlotBitmaps:
+    """Registre des créneaux occupés sous forme de champ de bits par praticien et par jour.
+
+    `bits` est une liste d'entiers 64 bits dont seuls les WORD_BITS bits de poids faible
+    servent (valeurs toujours positives) ; le créneau n du jour est le bit n % WORD_BITS
+    du mot n // WORD_BITS.
+    """
+
+    WORD_BITS = 60
+
+    def __init__(self, collection, slot_minutes=SCHEDULE_BITMAP_SLOT_MINUTES):
+        self.collection = collection
+        # Un changement de granularité impose une reconstruction, comme un changement de variante
+        self.name = f"bitmap:{slot_minutes}"
+        self.slot = datetime.timedelta(minutes=slot_minutes)
+        self.slots_per_day = 1440 // slot_minutes
+        self.words = -(-self.slots_per_day // self.WORD_BITS)
+
+    @staticmethod
+    def _doc_id(practitioner, day):
+        return f"{practitioner}|{day:%Y-%m-%d}"
+
+    def _masks(self, start, end):
+        """{jour: [masque par mot]} des créneaux couverts par [start, end[ (arrondi extérieur)."""
+        midnight = datetime.datetime.combine(start.date(), datetime.time.min)
+        first = (start - midnight) // self.slot
+        last = -(-(end - midnight) // self.slot)
+        masks = {}
+        for index in range(first, last):
+            day = start.date() + datetime.timedelta(days=index // self.slots_per_day)
+            position = index % self.slots_per_day
+            words = masks.setdefault(day, [0] * self.words)
+            words[position // self.WORD_BITS] |= 1 << (position % self.WORD_BITS)
+        return masks
+
+    def _ensure_day(self, practitioner, day):
+        try:
+            self.collection.update_one(
+                {"_id": self._doc_id(practitioner, day)},
+                {"$setOnInsert": {
+                    "practitioner": practitioner,
+                    "day": datetime.datetime.combine(day, datetime.time.min),
+                    "bits": [Int64(0)] * self.words
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # créé au même instant par une autre réservation
+
+    def _set_day(self, practitioner, day, words):
+        """Pose les bits `words` s'ils sont tous libres ; False sinon."""
+        query = {"_id": self._doc_id(practitioner, day)}
+        update = {}
+        for i, mask in enumerate(words):
+            if mask:
+                query[f"bits.{i}"] = {"$bitsAllClear": [b for b in range(self.WORD_BITS) if mask >> b & 1]}
+                update[f"bits.{i}"] = {"or": Int64(mask)}
+        if not update:
+            return True
+        if self.collection.update_one(query, {"$bit": update}).modified_count == 1:
+            return True
+        # Aucun document modifié : journée pas encore créée, ou conflit
+        self._ensure_day(practitioner, day)
+        return self.collection.update_one(query, {"$bit": update}).modified_count == 1
+
+    def _clear_day(self, practitioner, day, words):
+        full = (1 << self.WORD_BITS) - 1
+        update = {f"bits.{i}": {"and": Int64(full & ~mask)} for i, mask in enumerate(words) if mask}
+        if update:
+            self.collection.update_one({"_id": self._doc_id(practitioner, day)}, {"$bit": update})
+
+    def _reserve_masks(self, practitioner, masks):
+        reserved = []
+        for day, words in masks.items():
+            if not self._set_day(practitioner, day, words):
+                for done in reserved:
+                    self._clear_day(practitioner, done, masks[done])
+                return False
+            reserved.append(day)
+        return True
+
+    def reserve(self, practitioner, start, end, appt_id, ignore_id=None):
+        """Réserve les créneaux de [start, end[ ; False si l'un d'eux est pris.
+
+        Mêmes paramètres que IntervalReservations.reserve ; les bits ne portent pas
+        l'identifiant du RDV, un déplacement passe donc par `move`.
+        """
+        return self._reserve_masks(practitioner, self._masks(start, end))
+
+    def release(self, practitioner, start, end, appt_id):
+        for day, words in self._masks(start, end).items():
+            self._clear_day(practitioner, day, words)
+
+    def begin_move(self, practitioner, old_start, old_end, new_start, new_end, appt_id):
+        """Réserve les seuls créneaux nouveaux (voir IntervalReservations.begin_move)."""
+        old, new = self._masks(old_start, old_end), self._masks(new_start, new_end)
+        empty = [0] * self.words
+        added = {day: [n & ~o for n, o in zip(words, old.get(day, empty))] for day, words in new.items()}
+        removed = {day: [o & ~n for o, n in zip(words, new.get(day, empty))] for day, words in old.items()}
+        if not self._reserve_masks(practitioner, added):
+            return None
+        return {"practitioner": practitioner, "added": added, "removed": removed}
+
+    def commit_move(self, pending):
+        """Libère les créneaux de l'ancien horaire qui ne servent plus."""
+        for day, words in pending["removed"].items():
+            self._clear_day(pending["practitioner"], day, words)
+
+    def abort_move(self, pending):
+        """Libère les créneaux réservés par `begin_move` ; l'ancien horaire reste tel quel."""
+        for day, words in pending["added"].items():
+            self._clear_day(pending["practitioner"], day, words)
+
+    def move(self, practitioner, old_start, old_end, new_start, new_end, appt_id):
+        """Réserve les seuls créneaux nouveaux, puis libère ceux qui ne servent plus."""
+        pending = self.begin_move(practitioner, old_start, old_end, new_start, new_end, appt_id)
+        if pending is None:
+            return False
+        self.commit_move(pending)
+        return True
+
+    def busy_intervals(self, practitioners, start, end):
+        """Intervalles occupés {praticien: [(début, fin)]}, par suites de bits consécutifs."""
+        busy = {practitioner: [] for practitioner in practitioners}
+        cursor = self.collection.find(
+            {"practitioner": {"$in": list(practitioners)},
+             "day": {"$gte": datetime.datetime.combine(start.date(), datetime.time.min), "$lt": end}},
+            {"practitioner": 1, "day": 1, "bits": 1}
+        )
+        for doc in cursor:
+            run_start = None
+            for position in range(self.slots_per_day + 1):
+                word = doc["bits"][position // self.WORD_BITS] if position < self.slots_per_day else 0
+                is_set = bool(word >> (position % self.WORD_BITS) & 1)
+                if is_set and run_start is None:
+                    run_start = position
+                elif not is_set and run_start is not None:
+                    busy[doc["practitioner"]].append((doc["day"] + run_start * self.slot, doc["day"] + position * self.slot))
+                    run_start = None
+        return {practitioner: sorted(intervals) for practitioner, intervals in busy.items()}
+
+    def rebuild(self, appointments, since):
+        """Reconstruit les champs de bits à partir de `since` (voir IntervalReservations.rebuild)."""
+        docs = {}
+        for appt in appointments:
+            practitioner = appt["practitioner_id"]
+            for day, words in self._masks(appt["date_heure_debut"], appt["date_heure_fin"]).items():
+                bits = docs.setdefault((practitioner, day), [0] * self.words)
+                for i, mask in enumerate(words):
+                    bits[i] |= mask
+        self.collection.delete_many({"day": {"$gte": datetime.datetime.combine(since.date(), datetime.time.min)}})
+        if docs:
+            self.collection.insert_many([
+                {
+                    "_id": self._doc_id(practitioner, day),
+                    "practitioner": practitioner,
+                    "day": datetime.datetime.combine(day, datetime.time.min),
+                    "bits": [Int64(word) for word in bits]
+                }
+                for (practitioner, day), bits in docs.items()
+            ], ordered=False)
+        return len(docs)
+
+
+def schedule_store(db, backend=SCHEDULE_BACKEND):
+    """Registre de créneaux correspondant à SCHEDULE_BACKEND."""
+    if backend == "bitmap":
+        return SlotBitmaps(db.slot_bitmaps)
+    if backend == "intervals":
+        return IntervalReservations(db.reservations)
+    raise ValueError(f"SCHEDULE_BACKEND inconnu : {backend}")
@@ -0,0 +1,60 @@
+"""Clés de recherche normalisées des patients.
+
+Les noms sont mis en minuscules, débarrassés de leurs accents et découpés en mots
+(« Hélène DUPONT-Lévy » -> ["dupont", "helene", "levy"]). Ces clés sont stockées
+dans `patients.search_keys` (index multiclé) : une recherche par préfixe devient un
+intervalle [préfixe, préfixe suivant[ parcouru sur l'index, au lieu d'une regex non
+ancrée qui impose un parcours complet de la collection.
+"""
+import re
+import unicodedata
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Lettres sans décomposition Unicode : NFKD ne les réduit pas à une lettre de base,
+# elles disparaîtraient avec les signes diacritiques
+TRANSLITERATIONS = {
+    "ø": "o", "Ø": "O", "ß": "ss", "ẞ": "SS", "æ": "ae", "Æ": "AE", "œ": "oe", "Œ": "OE",
+    "ł": "l", "Ł": "L", "đ": "d", "Đ": "D", "ð": "d", "Ð": "D", "þ": "th", "Þ": "TH", "ı": "i",
+}
+_TRANSLITERATION_TABLE = str.maketrans(TRANSLITERATIONS)
+
+
+def normalize(text):
+    """Minuscules sans accents (« Éloïse » -> « eloise »).
+
+    >>> normalize("Éloïse")
+    'eloise'
+    >>> [normalize(nom) for nom in ("Søren", "Cœur", "Groß", "Ærø", "Łukasz")]
+    ['soren', 'coeur', 'gross', 'aero', 'lukasz']
+    """
+    decomposed = unicodedata.normalize("NFKD", (text or "").translate(_TRANSLITERATION_TABLE))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    """Mots normalisés d'un texte, dans l'ordre d'apparition."""
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def patient_search_keys(nom, prenom):
+    """Clés de recherche d'un patient à partir de son nom et prénom."""
+    return sorted(set(tokenize(nom) + tokenize(prenom)))
+
+
+def prefix_range(prefix):
+    """Condition d'intervalle équivalente à « commence par `prefix` », utilisable par un index."""
+    return {"$gte": prefix, "$lt": prefix[:-1] + chr(ord(prefix[-1]) + 1)}
+
+
+def prefix_query(text, field="search_keys"):
+    """Filtre MongoDB : chaque mot saisi doit être le préfixe d'une clé du patient.
+
+    Retourne None si le texte ne contient aucun mot exploitable.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    # $elemMatch : les deux bornes doivent porter sur la même clé du tableau
+    clauses = [{field: {"$elemMatch": prefix_range(token)}} for token in tokens]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}